@@ -1,15 +1,45 @@
+import asyncio
 import fastapi
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import SQLAlchemyError
 from routes import user
 from routes import message
+from routes import admin
+from sqlmodel import Session
+from database.database import engine, replica_engines
+from database.maintenance import run_tombstone_purge_loop
+from database.service import warm_statement_cache
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
-app = fastapi.FastAPI()
+
+def _warm_up():
+    # 編譯快取屬於各自的 engine，主資料庫與每個副本都要預熱
+    # 資料庫暫時無法連線時只略過預熱，不阻擋啟動
+    for db_engine in (engine, *replica_engines):
+        try:
+            with Session(db_engine) as session:
+                warm_statement_cache(session)
+        except SQLAlchemyError as e:
+            print(f"Statement cache warm-up skipped for {db_engine.url.host}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(_app: fastapi.FastAPI):
+    # 啟動時預先編譯熱路徑查詢
+    await asyncio.to_thread(_warm_up)
+    purge_task = asyncio.create_task(run_tombstone_purge_loop())
+    yield
+    purge_task.cancel()
+
+
+app = fastapi.FastAPI(lifespan=lifespan)
 app.include_router(user.router, prefix="/user", tags=["user"])
 app.include_router(message.router, prefix="/message", tags=["message"])
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
 
 app.add_middleware(
     CORSMiddleware,
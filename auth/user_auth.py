@@ -1,10 +1,11 @@
 from database.service import get_user_by_id
 from jose import JWTError, jwt
 import os
+from uuid import UUID
 from database.models import User
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from database.database import get_session
+from database.database import IS_SQLITE, get_session_context, run_read
 
 load_dotenv()
 
@@ -27,7 +28,12 @@ def verify_token(token: str | None) -> User | None:
         if not (user_id := payload.get("sub")):
             return None
 
-        return get_user_by_id(get_session(), user_id)
+        # 每次都從主資料庫讀取，membership_version 等欄位才會是最新的；
+        # SQLite 的讀取連線與寫入連線同一個檔案、沒有複寫延遲，改走讀取連線以免佔用唯一的寫入連線與寫入鎖
+        if IS_SQLITE:
+            return run_read(lambda session: get_user_by_id(session, UUID(user_id)))
+        with get_session_context() as session:
+            return get_user_by_id(session, UUID(user_id))
 
     except (JWTError, ValueError):  # 捕捉具體可能的錯誤
         return None
@@ -1,21 +1,173 @@
 # database.py
+from collections import deque
 from contextlib import contextmanager
+from itertools import cycle
+from typing import Callable, TypeVar
+from uuid import UUID
+import threading
+import time
 from sqlmodel import SQLModel, create_engine
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine, URL, make_url
+from sqlalchemy.exc import DBAPIError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
 from dotenv import load_dotenv
 import os
 from sqlmodel import Session
 from database.models import User, ChatRoom, ChatRoomPivot, Message, MessageRead
+from monitoring.tracing import trace_sql_statements
 
 load_dotenv()
 
-DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+# 以連線字串選擇後端，例如 sqlite:///chat.db；未設定時沿用 DB_* 組成的 PostgreSQL 連線
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
 
-engine = create_engine(DATABASE_URL, echo=False)
+# SQLite 設定：synchronous 在 WAL 下用 NORMAL 即可保證一致性；cache_size 以 KiB 計
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+# 等待寫入連線或其他行程釋放鎖的上限（毫秒），寫入因此排隊而不是立刻回報 database is locked
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _is_memory_database(url: URL) -> bool:
+    return url.database in (None, "", ":memory:")
+
+
+class _FifoLock:
+    """依等待順序交接的鎖；threading.Lock 與 QueuePool 都允許剛釋放的執行緒插隊，會讓等待者餓死"""
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._waiters: deque[threading.Lock] = deque()
+        self._locked = False
+
+    def acquire(self, timeout: float) -> bool:
+        with self._mutex:
+            if not self._locked:
+                self._locked = True
+                return True
+            waiter = threading.Lock()
+            waiter.acquire()
+            self._waiters.append(waiter)
+        if waiter.acquire(timeout=timeout):
+            return True
+        with self._mutex:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return False
+        # 逾時的同時剛好被交接到鎖
+        return True
+
+    def release(self) -> None:
+        with self._mutex:
+            if self._waiters:
+                # 直接交給最早的等待者，鎖維持在鎖定狀態
+                self._waiters.popleft().release()
+            else:
+                self._locked = False
+
+
+class _SerializedPoolMixin:
+    """一次只借出一條連線，等待的執行緒依先後順序取得"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._turns = _FifoLock()
+        self._turn_timeout = SQLITE_BUSY_TIMEOUT_MS / 1000
+
+    def _do_get(self):
+        if not self._turns.acquire(self._turn_timeout):
+            raise PoolTimeoutError(f"SQLite connection timed out, timeout {self._turn_timeout:.2f}")
+        try:
+            return super()._do_get()
+        except BaseException:
+            self._turns.release()
+            raise
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._turns.release()
+
+
+class SerializedQueuePool(_SerializedPoolMixin, QueuePool):
+    """SQLite 檔案資料庫寫入端的連線池"""
+
+
+class SerializedStaticPool(_SerializedPoolMixin, StaticPool):
+    """SQLite 記憶體資料庫的連線池：所有執行緒共用同一條連線，必須輪流使用"""
+
+
+def create_sqlite_engine(url: str, writer: bool = True) -> Engine:
+    """
+    建立調整過 pragma 的 SQLite engine。
+    寫入端只有一條連線，行程內的寫入交易在連線池依先後順序排隊（SQLite 的 busy handler
+    以輪詢等待，競爭激烈時不公平且會逾時）；每個交易以 BEGIN IMMEDIATE 開始，
+    先取得寫入鎖再讀取，不會在讀轉寫時失敗，也讓多個行程之間依 busy_timeout 等待。
+    讀取端以 query_only 連線開啟延遲交易，在 WAL 下不會阻擋寫入。
+    記憶體資料庫只有一條共用連線，同樣依序借出
+    """
+    sqlite_url = make_url(url)
+    if _is_memory_database(sqlite_url):
+        kwargs = {"poolclass": SerializedStaticPool}
+    elif writer:
+        kwargs = {"poolclass": SerializedQueuePool, "pool_size": 1, "max_overflow": 0}
+    else:
+        # WAL 下讀取彼此不互斥，連線不足時直接開新連線而不等待
+        kwargs = {"pool_size": 8, "max_overflow": -1}
+    sqlite_engine = create_engine(
+        sqlite_url, echo=False, connect_args={"check_same_thread": False}, **kwargs)
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # 停用 pysqlite 自行發出的 BEGIN，交易改由下方的 begin 事件控制
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        if not writer:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    @event.listens_for(sqlite_engine, "begin")
+    def begin_transaction(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE" if writer else "BEGIN")
+
+    return sqlite_engine
+
+
+engine = create_sqlite_engine(DATABASE_URL) if IS_SQLITE else create_engine(DATABASE_URL, echo=False)
+trace_sql_statements()
+
+# 讀取副本：以逗號分隔的連線字串，未設定時所有讀取都走主資料庫
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+# 副本落後超過此秒數即暫時不使用
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+# 副本連線失敗後，隔多久再嘗試
+DB_REPLICA_RETRY_AFTER = float(os.getenv("DB_REPLICA_RETRY_AFTER", "30"))
+# 使用者寫入後，這段時間內的讀取仍走主資料庫（read-your-writes）
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+# 副本延遲檢查結果的快取秒數
+REPLICA_LAG_CHECK_INTERVAL = 1.0
+
+replica_engines = [create_engine(url, echo=False, pool_pre_ping=True) for url in DB_REPLICA_URLS]
+# SQLite 檔案資料庫：另開一組唯讀連線當作副本，WAL 下讀取不必與寫入者排隊
+if IS_SQLITE and not _is_memory_database(make_url(DATABASE_URL)):
+    replica_engines.append(create_sqlite_engine(DATABASE_URL, writer=False))
 
 
 def create_db_and_tables():
+    if engine.dialect.name == "postgresql":
+        # 使用者搜尋的 trigram 索引需要 pg_trgm
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
     SQLModel.metadata.create_all(engine)
 
 
@@ -30,6 +182,149 @@ def get_session():
         yield session
 
 
+class ReplicaRouter:
+    """
+    將唯讀查詢分派到副本：輪詢可用的副本，
+    跳過連線失敗或延遲過大的副本，並在使用者剛寫入後改走主資料庫
+    """
+
+    # 副本非 standby（例如本機測試用的獨立資料庫）時視為無延遲；
+    # WAL receiver 未在串流（斷線或逾時 wal_receiver_timeout）時已套用的 LSN 不再代表追上主資料庫，回傳 NULL 視為延遲
+    LAG_QUERY = text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+        "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self, replicas: list[Engine], read_your_writes: bool = True):
+        self.replicas = replicas
+        self.read_your_writes = read_your_writes
+        self._next_replica = cycle(replicas)
+        # engine -> 在此時間前不使用（time.monotonic）
+        self._down_until: dict[Engine, float] = {}
+        # engine -> (檢查時間, 是否在可接受延遲內)
+        self._lag_state: dict[Engine, tuple[float, bool]] = {}
+        # user id -> 在此時間前讀取走主資料庫；依到期時間排序，寫入時順便清除過期項目
+        self._sticky_until: dict[UUID, float] = {}
+        self._sticky_lock = threading.Lock()
+
+    def mark_user_write(self, user_id: UUID) -> None:
+        if not (self.replicas and self.read_your_writes):
+            return
+        now = time.monotonic()
+        with self._sticky_lock:
+            # 先移除再插入，dict 的順序即為到期順序，過期項目都在最前面
+            self._sticky_until.pop(user_id, None)
+            self._sticky_until[user_id] = now + DB_READ_YOUR_WRITES_WINDOW
+            while self._sticky_until:
+                oldest = next(iter(self._sticky_until))
+                if self._sticky_until[oldest] > now:
+                    break
+                del self._sticky_until[oldest]
+
+    def connect(self, user_id: UUID | None = None) -> Connection | None:
+        """取得一個可用副本的連線；沒有合適的副本時回傳 None 表示改用主資料庫"""
+        if not self.replicas:
+            return None
+
+        now = time.monotonic()
+        if user_id is not None:
+            with self._sticky_lock:
+                sticky_until = self._sticky_until.get(user_id)
+                if sticky_until is not None:
+                    if sticky_until > now:
+                        return None
+                    self._sticky_until.pop(user_id, None)
+
+        for _ in range(len(self.replicas)):
+            replica = next(self._next_replica)
+            if self._down_until.get(replica, 0) > now:
+                continue
+            try:
+                connection = replica.connect()
+            except DBAPIError as e:
+                self._mark_down(replica, now, e)
+                continue
+            try:
+                if self._is_fresh(replica, connection, now):
+                    return connection
+            except DBAPIError as e:
+                self._mark_down(replica, now, e)
+            connection.close()
+        return None
+
+    def mark_down(self, replica: Engine, error: Exception) -> None:
+        """副本在查詢途中失效時由呼叫端回報"""
+        self._mark_down(replica, time.monotonic(), error)
+
+    def _mark_down(self, replica: Engine, now: float, error: Exception) -> None:
+        print(f"Replica {replica.url.host or replica.url.database} unavailable: {error}")
+        self._down_until[replica] = now + DB_REPLICA_RETRY_AFTER
+
+    def _is_fresh(self, replica: Engine, connection: Connection, now: float) -> bool:
+        if replica.dialect.name != "postgresql":
+            return True
+        checked_at, fresh = self._lag_state.get(replica, (0.0, True))
+        if now - checked_at < REPLICA_LAG_CHECK_INTERVAL:
+            return fresh
+        lag = connection.execute(self.LAG_QUERY).scalar()
+        connection.rollback()
+        fresh = lag is not None and float(lag) <= DB_REPLICA_MAX_LAG
+        self._lag_state[replica] = (now, fresh)
+        return fresh
+
+
+# SQLite 的唯讀連線與寫入端是同一個檔案，提交後立即可見，不需要 read-your-writes
+replica_router = ReplicaRouter(replica_engines, read_your_writes=not IS_SQLITE)
+
+
+def mark_user_write(user_id: UUID) -> None:
+    """記錄使用者剛寫入，之後短時間內的讀取會走主資料庫"""
+    replica_router.mark_user_write(user_id)
+
+
+@contextmanager
+def get_read_session_context(user_id: UUID | None = None):
+    """唯讀查詢用的 session：有可用副本時連到副本，否則退回主資料庫"""
+    connection = replica_router.connect(user_id)
+    if connection is None:
+        with get_session_context() as session:
+            yield session
+        return
+
+    try:
+        with Session(bind=connection) as session:
+            yield session
+    except OperationalError as e:
+        replica_router.mark_down(connection.engine, e)
+        raise
+    finally:
+        connection.close()
+
+
+T = TypeVar("T")
+
+
+def run_read(func: Callable[[Session], T], user_id: UUID | None = None) -> T:
+    """
+    以唯讀 session 執行 func：有可用副本時在副本上執行；
+    副本在查詢途中失效（斷線、與復原衝突而取消查詢等）時標記為不可用，並改在主資料庫重試一次
+    """
+    connection = replica_router.connect(user_id)
+    if connection is not None:
+        try:
+            with Session(bind=connection) as session:
+                return func(session)
+        except OperationalError as e:
+            replica_router.mark_down(connection.engine, e)
+        finally:
+            connection.close()
+
+    with get_session_context() as session:
+        return func(session)
+
+
 if __name__ == "__main__":
     create_db_and_tables()
     print("資料庫表格建立完成！")
@@ -0,0 +1,45 @@
+# maintenance.py
+import asyncio
+import os
+from datetime import timedelta
+from sqlalchemy.exc import SQLAlchemyError
+from database.database import get_session_context
+from database.service import MessageService
+
+# 軟刪除的訊息保留多久後才實際刪除
+TOMBSTONE_GRACE_DAYS = float(os.getenv("TOMBSTONE_GRACE_DAYS", "7"))
+# 清除工作的執行間隔（秒）與每批刪除的訊息數
+TOMBSTONE_PURGE_INTERVAL = float(os.getenv("TOMBSTONE_PURGE_INTERVAL", "3600"))
+TOMBSTONE_PURGE_BATCH_SIZE = int(os.getenv("TOMBSTONE_PURGE_BATCH_SIZE", "500"))
+# 每批等待列鎖的上限（毫秒，僅 PostgreSQL）
+TOMBSTONE_PURGE_LOCK_TIMEOUT_MS = int(os.getenv("TOMBSTONE_PURGE_LOCK_TIMEOUT_MS", "2000"))
+
+
+def report_tombstone_ratios(limit: int = 20) -> None:
+    """輸出墓碑比例最高的聊天室"""
+    with get_session_context() as session:
+        stats = MessageService(session).get_tombstone_stats(limit)
+    for room_id, total, deleted in stats:
+        print(f"Tombstones in room {room_id}: {deleted}/{total} ({deleted / total:.1%})")
+
+
+def purge_tombstones() -> int:
+    """清除超過保留期限的墓碑，回傳刪除的訊息數"""
+    with get_session_context() as session:
+        return MessageService(session).purge_deleted_messages(
+            timedelta(days=TOMBSTONE_GRACE_DAYS),
+            batch_size=TOMBSTONE_PURGE_BATCH_SIZE,
+            lock_timeout_ms=TOMBSTONE_PURGE_LOCK_TIMEOUT_MS
+        )
+
+
+async def run_tombstone_purge_loop():
+    """背景定期清除墓碑，單次失敗（例如等鎖逾時）只記錄並等待下一輪"""
+    while True:
+        await asyncio.sleep(TOMBSTONE_PURGE_INTERVAL)
+        try:
+            await asyncio.to_thread(report_tombstone_ratios)
+            purged = await asyncio.to_thread(purge_tombstones)
+            print(f"Purged {purged} deleted messages")
+        except SQLAlchemyError as e:
+            print(f"Tombstone purge failed: {e}")
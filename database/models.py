@@ -1,12 +1,79 @@
 # models.py
 from typing import Optional, List
 from sqlmodel import SQLModel, Field, Relationship, Index, select
+from sqlalchemy import func, text
 from datetime import datetime
 from uuid import UUID, uuid4
+import os
+import secrets
+import threading
+import time
+import zlib
 import pytz
 
 USERS_ID_COL = "Users.id"
 
+# 部分索引條件：寫法需與查詢中的 Message.is_deleted == False / True 一致，
+# 規劃器才會選用對應的部分索引
+LIVE_MESSAGES_PG = text("is_deleted = false")
+LIVE_MESSAGES_SQLITE = text("is_deleted = 0")
+DELETED_MESSAGES_PG = text("is_deleted = true")
+DELETED_MESSAGES_SQLITE = text("is_deleted = 1")
+
+# 訊息內容超過此位元組數時以 zlib 壓縮後存放在 compressed_content
+MESSAGE_COMPRESS_THRESHOLD = int(os.getenv("MESSAGE_COMPRESS_THRESHOLD", "1024"))
+MESSAGE_COMPRESS_LEVEL = int(os.getenv("MESSAGE_COMPRESS_LEVEL", "6"))
+
+
+def encode_message_content(content: str) -> tuple[str, bytes | None]:
+    """回傳要寫入 (content, compressed_content) 的值；只有壓縮後確實變小才壓縮"""
+    raw = content.encode("utf-8")
+    if len(raw) > MESSAGE_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(raw, MESSAGE_COMPRESS_LEVEL)
+        if len(compressed) < len(raw):
+            return "", compressed
+    return content, None
+
+
+def decode_message_content(content: str, compressed: bytes | None) -> str:
+    if compressed is None:
+        return content
+    return zlib.decompress(compressed).decode("utf-8")
+
+
+_uuid7_lock = threading.Lock()
+_uuid7_last_ms = 0
+_uuid7_counter = 0
+
+
+def uuid7() -> UUID:
+    """
+    產生 RFC 9562 UUIDv7：前 48 位元為毫秒時間戳，接著 12 位元的遞增計數器，
+    同一行程內產生的 id 嚴格遞增。新資料依時間順序寫入主鍵 B-tree 尾端，
+    與既有的 uuid4 資料共用相同欄位型別
+    """
+    global _uuid7_last_ms, _uuid7_counter
+    with _uuid7_lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _uuid7_last_ms:
+            _uuid7_last_ms = now_ms
+            # 計數器從較低的隨機值開始，保留同一毫秒內遞增的空間
+            _uuid7_counter = secrets.randbits(11)
+        else:
+            # 同一毫秒或時鐘倒退：沿用上一個時間戳並遞增計數器，用盡時借用下一毫秒
+            _uuid7_counter += 1
+            if _uuid7_counter > 0xFFF:
+                _uuid7_last_ms += 1
+                _uuid7_counter = 0
+        timestamp_ms, counter = _uuid7_last_ms, _uuid7_counter
+
+    value = (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76
+    value |= counter << 64
+    value |= 0b10 << 62
+    value |= secrets.randbits(62)
+    return UUID(int=value)
+
 
 # -----------------------------
 # 1. Users 表
@@ -19,6 +86,8 @@ class User(SQLModel, table=True):
     username: str = Field(max_length=20, nullable=False)
     hash_password: str = Field(max_length=255, nullable=False)
     salt: str = Field(max_length=255, nullable=False)
+    # 加入/離開聊天室時遞增，作為聊天室列表的 ETag
+    membership_version: int = Field(default=0, nullable=False)
 
     # 關係：發送的訊息
     sent_messages: List["Message"] = Relationship(back_populates="author")
@@ -27,6 +96,17 @@ class User(SQLModel, table=True):
     # 關係：已讀的訊息
     read_messages: List["MessageRead"] = Relationship(back_populates="user")
 
+    # 使用者搜尋：PostgreSQL 以 pg_trgm 的 GIN 索引同時支援前綴（LIKE 'q%'）與模糊比對，
+    # SQLite 以 lower() 運算式索引支援前綴範圍查詢
+    __table_args__ = (
+        Index("idx_users_username_trgm", text("lower(username) gin_trgm_ops"),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("idx_users_user_id_trgm", text("lower(user_id) gin_trgm_ops"),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("idx_users_username_lower", func.lower(text("username"))).ddl_if(dialect="sqlite"),
+        Index("idx_users_user_id_lower", func.lower(text("user_id"))).ddl_if(dialect="sqlite"),
+    )
+
 
 # -----------------------------
 # 2. ChatRoomList 表
@@ -38,6 +118,10 @@ class ChatRoom(SQLModel, table=True):
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(pytz.utc))
     name: Optional[str] = Field(default=None, max_length=50)
+    # 最後一則訊息的序號，每新增一則訊息加一
+    last_seq: int = Field(default=0, nullable=False)
+    # 最後一則訊息的時間（UTC，與 created_at 相同），與 last_seq 同時更新，用於挑選最近活躍的聊天室
+    last_message_at: Optional[datetime] = Field(default=None)
 
     # 關係：成員
     members: List["ChatRoomPivot"] = Relationship(back_populates="chatroom")
@@ -52,7 +136,7 @@ class ChatRoom(SQLModel, table=True):
 class ChatRoomPivot(SQLModel, table=True):
     __tablename__ = "ChatRoom_pivot"
 
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    id: UUID = Field(default_factory=uuid7, primary_key=True)
     chatroom_id: UUID = Field(foreign_key="ChatRoomList.id", nullable=False)
     user_id: UUID = Field(foreign_key=USERS_ID_COL, nullable=False)
     joined_at: datetime = Field(default_factory=lambda: datetime.now(pytz.utc))
@@ -64,6 +148,8 @@ class ChatRoomPivot(SQLModel, table=True):
     # 複合唯一索引：一人只能加入一次
     __table_args__ = (
         Index("uniq_chatroom_user", "chatroom_id", "user_id", unique=True),
+        # 依使用者查詢所屬聊天室（連線時訂閱、房間列表）
+        Index("idx_chatroom_pivot_user", "user_id"),
     )
 
 
@@ -73,11 +159,17 @@ class ChatRoomPivot(SQLModel, table=True):
 class Message(SQLModel, table=True):
     __tablename__ = "Messages"
 
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    id: UUID = Field(default_factory=uuid7, primary_key=True)
     chatroom_id: UUID = Field(foreign_key="ChatRoomList.id", nullable=False)
     author_id: UUID = Field(foreign_key=USERS_ID_COL, nullable=False)
+    # 壓縮存放時為空字串，原文在 compressed_content；讀取請用 body
     content: str = Field(nullable=False)
+    compressed_content: Optional[bytes] = Field(default=None)
+    # 聊天室內單調遞增的序號，新增訊息時由 ChatRoom.last_seq 配發
+    seq: int = Field(default=0, nullable=False)
     is_deleted: bool = Field(default=False)
+    # 軟刪除時間，清除墓碑時用來計算保留期限
+    deleted_at: Optional[datetime] = Field(default=None)
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(pytz.utc))
 
@@ -87,10 +179,22 @@ class Message(SQLModel, table=True):
     # 誰讀了這則訊息
     read_by: List["MessageRead"] = Relationship(back_populates="message")
 
+    @property
+    def body(self) -> str:
+        """訊息原文（必要時解壓縮）"""
+        return decode_message_content(self.content, self.compressed_content)
+
     # 索引優化
     __table_args__ = (
-        Index("idx_messages_chatroom_time", "chatroom_id", "created_at"),
+        # 只索引未刪除的訊息，已刪除的墓碑不會讓歷史查詢的索引膨脹
+        # 歷史分頁以 (created_at, id) 為游標，新舊（uuid4 / UUIDv7）id 混用時仍有一致的順序
+        Index("idx_messages_chatroom_time_id_live", "chatroom_id", "created_at", "id",
+              postgresql_where=LIVE_MESSAGES_PG, sqlite_where=LIVE_MESSAGES_SQLITE),
+        Index("uniq_messages_chatroom_seq", "chatroom_id", "seq", unique=True),
         Index("idx_messages_author", "author_id"),
+        # 清除墓碑時依刪除時間找出過期的訊息
+        Index("idx_messages_tombstones", "deleted_at",
+              postgresql_where=DELETED_MESSAGES_PG, sqlite_where=DELETED_MESSAGES_SQLITE),
     )
 
 
@@ -100,7 +204,7 @@ class Message(SQLModel, table=True):
 class MessageRead(SQLModel, table=True):
     __tablename__ = "MessageReads"
 
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    id: UUID = Field(default_factory=uuid7, primary_key=True)
     message_id: UUID = Field(foreign_key="Messages.id", nullable=False)
     user_id: UUID = Field(foreign_key=USERS_ID_COL, nullable=False)
     read_at: datetime = Field(
@@ -1,12 +1,41 @@
 from sqlmodel import select, Session
+from sqlalchemy import and_, case, delete, exists, func, insert, lambda_stmt, literal, not_, or_, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from uuid import UUID
 from dataclasses import dataclass
-from typing import List
-from database.models import User, ChatRoom, ChatRoomPivot, Message, MessageRead
-from datetime import datetime
+from typing import Iterator, List
+from database.models import User, ChatRoom, ChatRoomPivot, Message, MessageRead, decode_message_content, encode_message_content, uuid7
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
+from monitoring.tracing import trace_methods, traced
 
+
+def _dialect_insert(session: Session, model):
+    """取得支援 ON CONFLICT 的 INSERT 建構式（PostgreSQL / SQLite）"""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def _sql_random_uuid(session: Session):
+    """在資料庫端產生主鍵，供 INSERT ... SELECT 使用"""
+    if session.get_bind().dialect.name == "postgresql":
+        return func.gen_random_uuid()
+    # SQLite 的 Uuid 欄位以 32 個十六進位字元儲存
+    return func.lower(func.hex(func.randomblob(16)))
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """回傳大於所有以 prefix 開頭字串的最小字串，用於索引範圍查詢"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+@trace_methods("service")
 class ChatRoomService:
     def __init__(self, session: Session):
         self.session = session
@@ -17,9 +46,30 @@ class ChatRoomService:
         self.session.refresh(chat_room)
         return chat_room
 
+    def create_chat_room_with_members(self, chat_room: ChatRoom, user_ids: list[UUID]) -> ChatRoom:
+        """在同一個交易中建立聊天室，並以單一多列 INSERT 加入所有成員"""
+        self.session.add(chat_room)
+        self.session.flush()
+
+        member_ids = list(dict.fromkeys(user_ids))
+        if member_ids:
+            # 與 ChatRoomPivot.joined_at 的預設值相同以 UTC 記錄
+            joined_at = datetime.now(timezone.utc)
+            self.session.exec(insert(ChatRoomPivot).values([
+                {"id": uuid7(), "chatroom_id": chat_room.id, "user_id": user_id, "joined_at": joined_at}
+                for user_id in member_ids
+            ]))
+            self.bump_membership_versions(member_ids)
+
+        self.session.commit()
+        self.session.refresh(chat_room)
+        return chat_room
+
     def get_chat_room_by_id(self, chat_room_id: UUID) -> ChatRoom | None:
-        statement = select(ChatRoom).where(ChatRoom.id == chat_room_id)
-        result = self.session.exec(statement).first()
+        # 熱路徑使用 lambda_stmt：語句結構只建構與編譯一次，之後僅替換參數
+        statement = lambda_stmt(
+            lambda: select(ChatRoom).where(ChatRoom.id == chat_room_id))
+        result = self.session.exec(statement).scalars().first()
         return result
 
     def get_users_in_chat_room(self, chat_room: ChatRoom) -> list[User]:
@@ -29,10 +79,33 @@ class ChatRoomService:
         results = self.session.exec(statement).all()
         return results
 
+    def get_member_ids(self, chat_room_id: UUID) -> list[UUID]:
+        statement = select(ChatRoomPivot.user_id).where(
+            ChatRoomPivot.chatroom_id == chat_room_id
+        )
+        return list(self.session.exec(statement).all())
+
+    def is_user_in_chat_room(self, user_id: UUID, chat_room_id: UUID) -> bool:
+        statement = select(ChatRoomPivot.id).where(
+            ChatRoomPivot.user_id == user_id,
+            ChatRoomPivot.chatroom_id == chat_room_id
+        )
+        return self.session.exec(statement).first() is not None
+
+    def bump_membership_versions(self, user_ids: list[UUID]) -> None:
+        """遞增使用者的聊天室成員版本，與成員異動在同一個交易中提交"""
+        self.session.exec(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(membership_version=User.membership_version + 1)
+        )
+
     def add_user_to_chat_room(self, user: User, chat_room: ChatRoom) -> None:
         pivot = ChatRoomPivot(user_id=user.id, chatroom_id=chat_room.id)
         self.session.add(pivot)
         try:
+            # UPDATE 會先 autoflush 新的成員列，重複加入的 IntegrityError 也必須在此攔截
+            self.bump_membership_versions([user.id])
             self.session.commit()
         except IntegrityError:
             self.session.rollback()
@@ -47,36 +120,90 @@ class ChatRoomService:
         pivot = self.session.exec(statement).first()
         if pivot:
             self.session.delete(pivot)
+            self.bump_membership_versions([user.id])
             self.session.commit()
-
-            remaining_users_statement = select(ChatRoomPivot).where(
-                ChatRoomPivot.chatroom_id == chat_room.id
+            self._delete_chat_room_if_empty(chat_room)
+
+    def add_users_to_chat_room(self, chat_room: ChatRoom, user_ids: list[UUID]) -> list[UUID]:
+        """以單一多列 INSERT 加入多位成員，已是成員者略過；回傳實際加入的使用者"""
+        if not user_ids:
+            return []
+        joined_at = datetime.now(timezone.utc)
+        statement = (
+            _dialect_insert(self.session, ChatRoomPivot)
+            .values([
+                {"id": uuid7(), "chatroom_id": chat_room.id, "user_id": user_id, "joined_at": joined_at}
+                for user_id in dict.fromkeys(user_ids)
+            ])
+            .on_conflict_do_nothing(index_elements=["chatroom_id", "user_id"])
+            .returning(ChatRoomPivot.user_id)
+        )
+        added = list(self.session.exec(statement).scalars())
+        if added:
+            self.bump_membership_versions(added)
+        self.session.commit()
+        return added
+
+    def remove_users_from_chat_room(self, chat_room: ChatRoom, user_ids: list[UUID]) -> list[UUID]:
+        """以單一 DELETE 移除多位成員；回傳實際移除的使用者，聊天室沒有成員時一併刪除"""
+        if not user_ids:
+            return []
+        statement = (
+            delete(ChatRoomPivot)
+            .where(
+                ChatRoomPivot.chatroom_id == chat_room.id,
+                ChatRoomPivot.user_id.in_(user_ids)
             )
-            remaining_pivots = self.session.exec(remaining_users_statement).all()
-            if not remaining_pivots:
-                messages_statement = select(Message).where(
-                    Message.chatroom_id == chat_room.id
-                )
-                messages = self.session.exec(messages_statement).all()
-                for message in messages:
-                    self.session.delete(message)
+            .returning(ChatRoomPivot.user_id)
+        )
+        removed = list(self.session.exec(statement).scalars())
+        if removed:
+            self.bump_membership_versions(removed)
+        self.session.commit()
+        if removed:
+            self._delete_chat_room_if_empty(chat_room)
+        return removed
 
-                self.session.delete(chat_room)
-                self.session.commit()
+    def _delete_chat_room_if_empty(self, chat_room: ChatRoom) -> None:
+        remaining_users_statement = select(ChatRoomPivot.id).where(
+            ChatRoomPivot.chatroom_id == chat_room.id
+        )
+        if self.session.exec(remaining_users_statement).first() is not None:
+            return
+
+        # 以批次語句刪除，不把整個聊天室的訊息載入記憶體
+        room_messages = select(Message.id).where(Message.chatroom_id == chat_room.id)
+        self.session.exec(delete(MessageRead).where(MessageRead.message_id.in_(room_messages)))
+        self.session.exec(delete(Message).where(Message.chatroom_id == chat_room.id))
+        self.session.delete(chat_room)
+        self.session.commit()
 
     def get_chat_rooms_by_user(self, user: User) -> list[ChatRoom]:
-        statement = select(ChatRoom).join(ChatRoomPivot).where(
-            ChatRoomPivot.user_id == user.id
-        )
-        results = self.session.exec(statement).all()
+        user_id = user.id
+        statement = lambda_stmt(lambda: select(ChatRoom).join(ChatRoomPivot).where(
+            ChatRoomPivot.user_id == user_id
+        ))
+        results = self.session.exec(statement).scalars().all()
         return results
 
+    def get_chat_room_ids_by_user(self, user_id: UUID, limit: int | None = None) -> list[UUID]:
+        """只取聊天室 id；指定 limit 時依最後活動時間取最近的 limit 個"""
+        statement = select(ChatRoom.id).join(ChatRoomPivot).where(
+            ChatRoomPivot.user_id == user_id
+        )
+        if limit is not None:
+            statement = statement.order_by(
+                func.coalesce(ChatRoom.last_message_at, ChatRoom.created_at).desc()
+            ).limit(limit)
+        return list(self.session.exec(statement).all())
+
 
+@trace_methods("service")
 class MessageService:
     def __init__(self, session: Session):
         self.session = session
 
-    @dataclass
+    @dataclass(slots=True)
     class MessageDTO:
         id: UUID
         author_id: UUID
@@ -85,13 +212,28 @@ class MessageService:
         content: str
         created_at: any
         is_read: bool
+        seq: int
+        is_deleted: bool = False
 
     def create_message(self, user: User, chat_room: ChatRoom, content: str) -> Message:
+        # 以 UPDATE ... RETURNING 原子地配發序號，該列鎖會持續到 commit，
+        # 同一聊天室的訊息因此依序號順序寫入
+        created_at = datetime.now(tz=ZoneInfo("Asia/Taipei"))
+        seq = self.session.exec(
+            update(ChatRoom)
+            .where(ChatRoom.id == chat_room.id)
+            # 與 ChatRoom.created_at 同以 UTC 記錄，兩者才能一起排序
+            .values(last_seq=ChatRoom.last_seq + 1, last_message_at=created_at.astimezone(timezone.utc))
+            .returning(ChatRoom.last_seq)
+        ).scalar_one()
+        stored_content, compressed_content = encode_message_content(content)
         message = Message(
             author_id=user.id,
             chatroom_id=chat_room.id,
-            content=content,
-            created_at=datetime.now(tz=ZoneInfo("Asia/Taipei"))
+            content=stored_content,
+            compressed_content=compressed_content,
+            seq=seq,
+            created_at=created_at
         )
         self.session.add(message)
         self.session.commit()
@@ -113,42 +255,74 @@ class MessageService:
         results = self.session.exec(statement).all()
         return results
 
+    def iter_messages_for_export(self, room_id: UUID, after_seq: int = 0,
+                                 batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        依序號串流聊天室內的訊息，只取匯出需要的欄位；
+        yield_per 會改用伺服器端游標，記憶體用量與聊天室大小無關
+        """
+        statement = (
+            select(Message.seq, Message.id, User.username, Message.content,
+                   Message.compressed_content, Message.created_at)
+            .join(User, Message.author_id == User.id)
+            .where(
+                Message.chatroom_id == room_id,
+                Message.seq > after_seq,
+                Message.is_deleted == False
+            )
+            .order_by(Message.seq)
+            .execution_options(yield_per=batch_size)
+        )
+        for seq, message_id, author_name, content, compressed_content, created_at in self.session.exec(statement):
+            yield seq, message_id, author_name, decode_message_content(content, compressed_content), created_at
+
     def get_messages_by_room(
         self,
         room_id,
         user_id,
         limit=50,
-        before_created_at=None
+        before_created_at=None,
+        before_id: UUID | None = None
     ):
-        is_read_subq = (
-            select(MessageRead.id)
-            .where(
-                MessageRead.message_id == Message.id,
-                MessageRead.user_id == user_id
-            )
-            .exists()
-        )
-
+        """
+        由新到舊取出聊天室訊息。before_id 以該則訊息的 (created_at, id) 作為游標；
+        不能只比較 id，舊的 uuid4 id 與 UUIDv7 之間沒有時間順序
+        """
         # 使用 JOIN 一次取出作者名稱，避免在迭代中每則訊息查詢作者造成 N+1
-        query = (
-            self.session.query(
+        statement = lambda_stmt(lambda: (
+            select(
                 Message,
                 User.username.label("author_name"),
-                is_read_subq.label("is_read")
+                select(MessageRead.id)
+                .where(
+                    MessageRead.message_id == Message.id,
+                    MessageRead.user_id == user_id
+                )
+                .exists()
+                .label("is_read")
             )
             .join(User, Message.author_id == User.id)
-            .filter(
+            .where(
                 Message.chatroom_id == room_id,
-                Message.is_deleted.is_(False)
+                Message.is_deleted == False
+            )
+        ))
+
+        if before_id is not None:
+            statement += lambda s: s.where(
+                tuple_(Message.created_at, Message.id) < tuple_(
+                    select(Message.created_at)
+                    .where(Message.id == before_id)
+                    .correlate(None)
+                    .scalar_subquery(),
+                    before_id
+                )
             )
-            .order_by(Message.created_at.desc())
-            .limit(limit)
-        )
-
         if before_created_at:
-            query = query.filter(Message.created_at < before_created_at)
+            statement += lambda s: s.where(Message.created_at < before_created_at)
+        statement += lambda s: s.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
 
-        rows = query.all()
+        rows = self.session.exec(statement).all()
         dto_list: List[MessageService.MessageDTO] = []
         for msg, author_name, is_read in rows:
             dto_list.append(MessageService.MessageDTO(
@@ -156,17 +330,133 @@ class MessageService:
                 author_id=msg.author_id,
                 author_name=author_name,
                 chatroom_id=msg.chatroom_id,
-                content=msg.content,
+                content=msg.body,
                 created_at=msg.created_at,
-                is_read=bool(is_read)
+                is_read=bool(is_read),
+                seq=msg.seq
             ))
         return dto_list
 
+    def get_latest_seqs(self, user_id: UUID, room_ids: list[UUID]) -> dict[UUID, int]:
+        """回傳使用者所屬聊天室中指定聊天室的最新序號，不屬於的聊天室不會出現在結果中"""
+        statement = select(ChatRoom.id, ChatRoom.last_seq).join(ChatRoomPivot).where(
+            ChatRoomPivot.user_id == user_id,
+            ChatRoom.id.in_(room_ids)
+        )
+        return {room_id: last_seq for room_id, last_seq in self.session.exec(statement)}
+
+    def get_messages_after_seq(self, room_id: UUID, user_id: UUID, after_seq: int, limit: int = 100):
+        """
+        依序號由舊到新取出 after_seq 之後的訊息，供斷線重連後增量同步；
+        已刪除的訊息以不含內容的墓碑回傳，讓客戶端一併移除
+        """
+        statement = lambda_stmt(lambda: (
+            select(
+                Message,
+                User.username.label("author_name"),
+                select(MessageRead.id)
+                .where(
+                    MessageRead.message_id == Message.id,
+                    MessageRead.user_id == user_id
+                )
+                .exists()
+                .label("is_read")
+            )
+            .join(User, Message.author_id == User.id)
+            .where(Message.chatroom_id == room_id, Message.seq > after_seq)
+            .order_by(Message.seq)
+            .limit(limit)
+        ))
+
+        return [
+            MessageService.MessageDTO(
+                id=msg.id,
+                author_id=msg.author_id,
+                author_name=author_name,
+                chatroom_id=msg.chatroom_id,
+                content="" if msg.is_deleted else msg.body,
+                created_at=msg.created_at,
+                is_read=bool(is_read),
+                seq=msg.seq,
+                is_deleted=msg.is_deleted
+            )
+            for msg, author_name, is_read in self.session.exec(statement)
+        ]
+
     def delete_message(self, message: Message) -> None:
         message.is_deleted = True
+        message.deleted_at = datetime.now(tz=ZoneInfo("Asia/Taipei"))
         self.session.add(message)
         self.session.commit()
 
+    def purge_deleted_messages(self, grace_period: timedelta, batch_size: int = 500,
+                               lock_timeout_ms: int = 2000) -> int:
+        """
+        分批實際刪除超過保留期限的墓碑及其已讀紀錄，每批各自 commit，
+        避免長時間持有鎖；回傳刪除的訊息數
+        """
+        cutoff = datetime.now(tz=ZoneInfo("Asia/Taipei")) - grace_period
+        is_postgres = self.session.get_bind().dialect.name == "postgresql"
+        purged = 0
+        while True:
+            if is_postgres:
+                # 等不到鎖就放棄這一批，留待下次執行
+                self.session.exec(text(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}"))
+            # 早於此功能的墓碑沒有 deleted_at，視為已超過保留期限
+            statement = (
+                select(Message.id)
+                .where(
+                    Message.is_deleted == True,
+                    or_(Message.deleted_at.is_(None), Message.deleted_at < cutoff)
+                )
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            message_ids = self.session.exec(statement).all()
+            if not message_ids:
+                self.session.rollback()
+                return purged
+
+            self.session.exec(delete(MessageRead).where(MessageRead.message_id.in_(message_ids)))
+            self.session.exec(delete(Message).where(Message.id.in_(message_ids)))
+            self.session.commit()
+            purged += len(message_ids)
+            if len(message_ids) < batch_size:
+                return purged
+
+    def get_tombstone_stats(self, limit: int = 20) -> list[tuple[UUID, int, int]]:
+        """
+        回傳墓碑最多的聊天室 (chatroom_id, 訊息總數, 已刪除數)，供監控墓碑比例；
+        先經部分索引 idx_messages_tombstones 只掃描墓碑找出聊天室，再以 chatroom_id 索引計算這些聊天室的訊息總數，
+        不對整張訊息表做 GROUP BY
+        """
+        # 沒有統計資訊時 SQLite 會把子查詢攤平，並為了省去 GROUP BY 排序改掃 chatroom_id 索引（即整張表），
+        # 因此在 SQLite 上將墓碑先物化
+        tombstones = (
+            select(Message.chatroom_id, Message.id)
+            .where(Message.is_deleted == True)
+            .cte("tombstones")
+            .prefix_with("MATERIALIZED", dialect="sqlite")
+        )
+        deleted_count = func.count(tombstones.c.id)
+        deleted_statement = (
+            select(tombstones.c.chatroom_id, deleted_count)
+            .group_by(tombstones.c.chatroom_id)
+            .order_by(deleted_count.desc())
+            .limit(limit)
+        )
+        deleted = self.session.exec(deleted_statement).all()
+        if not deleted:
+            return []
+
+        total_statement = (
+            select(Message.chatroom_id, func.count(Message.id))
+            .where(Message.chatroom_id.in_([room_id for room_id, _ in deleted]))
+            .group_by(Message.chatroom_id)
+        )
+        totals = dict(self.session.exec(total_statement).all())
+        return [(room_id, totals.get(room_id, count), count) for room_id, count in deleted]
+
     def add_message_read_record(self, message: Message, room: ChatRoom):
         users = ChatRoomService(self.session).get_users_in_chat_room(room)
         for user in users:
@@ -182,24 +472,30 @@ class MessageService:
         return message_read
 
     def mark_room_as_read(self, user_id, room_id):
-        unread_messages = (
-            self.session.query(Message.id)
-            .filter(
-                Message.chatroom_id == room_id,
-                Message.author_id != user_id,
-                ~self.session.query(MessageRead)
-                .filter(
-                    MessageRead.user_id == user_id,
-                    MessageRead.message_id == Message.id
-                )
-                .exists()
+        """
+        以單一 INSERT ... SELECT 在資料庫內補齊未讀訊息的已讀紀錄，不把訊息 id 取回應用程式；
+        ON CONFLICT DO NOTHING 讓同時標記同一聊天室的請求不會因唯一索引衝突而失敗
+        """
+        unread_messages = select(
+            _sql_random_uuid(self.session),
+            Message.id,
+            literal(user_id, MessageRead.user_id.type),
+            func.now()
+        ).where(
+            Message.chatroom_id == room_id,
+            Message.author_id != user_id,
+            ~exists().where(
+                MessageRead.user_id == user_id,
+                MessageRead.message_id == Message.id
             )
         )
 
-        self.session.bulk_save_objects([
-            MessageRead(user_id=user_id, message_id=mid)
-            for (mid,) in unread_messages
-        ])
+        statement = (
+            _dialect_insert(self.session, MessageRead)
+            .from_select(["id", "message_id", "user_id", "read_at"], unread_messages)
+            .on_conflict_do_nothing(index_elements=["message_id", "user_id"])
+        )
+        self.session.exec(statement)
         self.session.commit()
 
     def get_read_status(self, message_id: UUID, user_id: UUID) -> MessageRead | None:
@@ -211,15 +507,75 @@ class MessageService:
         return result
 
 # user service
+@traced("service")
 def get_user_by_id(session: Session, user_id: UUID) -> User | None:
-    statement = select(User).where(User.id == user_id)
-    return session.exec(statement).first()
+    statement = lambda_stmt(lambda: select(User).where(User.id == user_id))
+    return session.exec(statement).scalars().first()
 
+@traced("service")
 def get_user_by_user_id(session: Session, user_id: str) -> User | None:
     statement = select(User).where(User.user_id == user_id)
     return session.exec(statement).first()
 
 
+@traced("service")
+def get_users_by_user_ids(session: Session, user_ids: list[str]) -> list[User]:
+    if not user_ids:
+        return []
+    statement = select(User).where(User.user_id.in_(user_ids))
+    return session.exec(statement).all()
+
+
+@traced("service")
+def search_users(session: Session, query: str, limit: int = 20, offset: int = 0) -> list[User]:
+    """
+    依 user_id 或 username 搜尋使用者（不分大小寫），前綴符合者排在前面。
+    PostgreSQL 以 pg_trgm 另外回傳相似度達門檻的模糊結果並依相似度排序；
+    SQLite 以索引範圍查詢前綴，不足一頁時才以子字串 LIKE 掃描補足（全表掃描，僅供開發使用）
+    """
+    query = query.strip().lower()
+    if not query:
+        return []
+    username = func.lower(User.username)
+    user_id = func.lower(User.user_id)
+    pattern = _like_escape(query) + "%"
+
+    if session.get_bind().dialect.name == "postgresql":
+        prefix = or_(username.like(pattern, escape="\\"), user_id.like(pattern, escape="\\"))
+        fuzzy = or_(username.op("%")(query), user_id.op("%")(query))
+        score = func.greatest(func.similarity(username, query), func.similarity(user_id, query))
+        statement = (
+            select(User)
+            .where(or_(prefix, fuzzy))
+            .order_by(case((prefix, 0), else_=1), score.desc(), User.user_id)
+            .offset(offset)
+            .limit(limit)
+        )
+        return session.exec(statement).all()
+
+    upper = _prefix_upper_bound(query)
+    prefix = or_(and_(username >= query, username < upper),
+                 and_(user_id >= query, user_id < upper))
+    wanted = offset + limit
+    prefix_users = session.exec(
+        select(User).where(prefix).order_by(User.user_id).limit(wanted)
+    ).all()
+    # 子字串比對需掃描整張表，與 trigram 一樣只對 3 個字元以上的查詢進行
+    if len(prefix_users) >= wanted or len(query) < 3:
+        return prefix_users[offset:]
+
+    fuzzy = and_(
+        or_(username.like("%" + pattern, escape="\\"), user_id.like("%" + pattern, escape="\\")),
+        not_(prefix)
+    )
+    rest = session.exec(
+        select(User).where(fuzzy).order_by(User.user_id)
+        .offset(max(0, offset - len(prefix_users)))
+        .limit(wanted - max(offset, len(prefix_users)))
+    ).all()
+    return prefix_users[offset:] + rest
+
+
 def create_user(session: Session, user: User) -> User:
     session.add(user)
     session.commit()
@@ -254,18 +610,25 @@ def get_messages_in_chat_room(session: Session, chat_room: ChatRoom) -> list[Mes
     return MessageService(session).get_messages_in_chat_room(chat_room)
 
 
+def iter_messages_for_export(session: Session, room_id: UUID, after_seq: int = 0,
+                             batch_size: int = 1000) -> Iterator[tuple]:
+    return MessageService(session).iter_messages_for_export(room_id, after_seq, batch_size)
+
+
 def get_messages_by_room(
     session,
     room_id,
     user_id,
     limit=50,
-    before_created_at=None
+    before_created_at=None,
+    before_id=None
 ):
     return MessageService(session).get_messages_by_room(
         room_id=room_id,
         user_id=user_id,
         limit=limit,
-        before_created_at=before_created_at
+        before_created_at=before_created_at,
+        before_id=before_id
     )
 
 
@@ -310,6 +673,14 @@ def get_users_in_chat_room(session: Session, chat_room: ChatRoom) -> list[User]:
     return ChatRoomService(session).get_users_in_chat_room(chat_room)
 
 
+def is_user_in_chat_room(session: Session, user_id: UUID, chat_room_id: UUID) -> bool:
+    return ChatRoomService(session).is_user_in_chat_room(user_id, chat_room_id)
+
+
+def get_member_ids(session: Session, chat_room_id: UUID) -> list[UUID]:
+    return ChatRoomService(session).get_member_ids(chat_room_id)
+
+
 def add_user_to_chat_room(session: Session, user: User, chat_room: ChatRoom) -> None:
     ChatRoomService(session).add_user_to_chat_room(user, chat_room)
 
@@ -318,5 +689,39 @@ def remove_user_from_chat_room(session: Session, user: User, chat_room: ChatRoom
     ChatRoomService(session).remove_user_from_chat_room(user, chat_room)
 
 
+def create_chat_room_with_members(session: Session, chat_room: ChatRoom, user_ids: list[UUID]) -> ChatRoom:
+    return ChatRoomService(session).create_chat_room_with_members(chat_room, user_ids)
+
+
+def add_users_to_chat_room(session: Session, chat_room: ChatRoom, user_ids: list[UUID]) -> list[UUID]:
+    return ChatRoomService(session).add_users_to_chat_room(chat_room, user_ids)
+
+
+def remove_users_from_chat_room(session: Session, chat_room: ChatRoom, user_ids: list[UUID]) -> list[UUID]:
+    return ChatRoomService(session).remove_users_from_chat_room(chat_room, user_ids)
+
+
 def get_chat_rooms_by_user(session: Session, user: User) -> list[ChatRoom]:
     return ChatRoomService(session).get_chat_rooms_by_user(user)
+
+
+def get_chat_room_ids_by_user(session: Session, user_id: UUID, limit: int | None = None) -> list[UUID]:
+    return ChatRoomService(session).get_chat_room_ids_by_user(user_id, limit)
+
+
+# statement cache warm-up
+def warm_statement_cache(session: Session) -> None:
+    """
+    以不存在的 id 執行一次熱路徑查詢，讓 lambda 語句與 SQL 編譯結果
+    在第一個請求前就進入 engine 的快取
+    """
+    placeholder = UUID(int=0)
+    chat_service = ChatRoomService(session)
+    chat_service.get_chat_room_by_id(placeholder)
+    chat_service.get_chat_rooms_by_user(User(id=placeholder))
+    message_service = MessageService(session)
+    message_service.get_messages_by_room(placeholder, placeholder)
+    message_service.get_messages_by_room(placeholder, placeholder,
+                                         before_created_at=datetime.now(tz=ZoneInfo("Asia/Taipei")))
+    message_service.get_messages_by_room(placeholder, placeholder, before_id=uuid7())
+    get_user_by_id(session, placeholder)
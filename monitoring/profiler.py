@@ -0,0 +1,51 @@
+# profiler.py
+import sys
+import threading
+import time
+from collections import Counter
+
+# 單次取樣的上限（秒），避免管理端點長時間占用
+PROFILE_MAX_SECONDS = 60
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """
+    每隔 interval 秒擷取所有執行緒的呼叫堆疊，持續 seconds 秒，
+    回傳 flamegraph.pl / speedscope 可讀取的 folded stacks 文字。
+    取樣器只讀取 sys._current_frames()，不需 settrace，對被測程式的影響很小
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("a profile is already running")
+    try:
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        own_thread = threading.get_ident()
+        thread_names = {}
+        stacks: Counter[str] = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if thread_id not in thread_names:
+                    thread_names = {t.ident: t.name for t in threading.enumerate()}
+                labels.append(thread_names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    finally:
+        _profile_lock.release()
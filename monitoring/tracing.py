@@ -0,0 +1,125 @@
+# tracing.py
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 設定後將 span 以 Chrome Trace Event 格式寫入此檔案，可用 Perfetto 或 chrome://tracing 開啟
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACING_ENABLED = bool(TRACE_FILE)
+# SQL span 中保留的語句長度上限
+TRACE_SQL_MAX_LENGTH = 500
+
+
+class TraceWriter:
+    """以 JSON Array 格式逐筆附加事件；格式允許省略結尾的 ]，行程中斷也不會損壞檔案"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() == 0:
+            self._file.write("[\n")
+        self._pid = os.getpid()
+
+    def write(self, name: str, category: str, start_ns: int, end_ns: int, args: dict):
+        record = json.dumps({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self._pid,
+            "tid": _track_id(),
+            "args": args
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(record + ",\n")
+            self._file.flush()
+
+
+def _track_id() -> int:
+    """同一執行緒上並行的 asyncio task 各自一條軌道，span 才不會互相交錯"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+_writer = TraceWriter(TRACE_FILE) if TRACING_ENABLED else None
+
+
+@contextmanager
+def span(name: str, category: str = "app", **args):
+    """記錄一段程式的執行時間；未啟用追蹤時不做任何事"""
+    if _writer is None:
+        yield
+        return
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _writer.write(name, category, start_ns, time.perf_counter_ns(), args)
+
+
+def traced(category: str, name: str | None = None):
+    """函式裝飾器：未啟用追蹤時直接回傳原函式，不增加呼叫成本"""
+    def decorator(func):
+        if _writer is None or inspect.isgeneratorfunction(func):
+            return func
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(category: str):
+    """類別裝飾器：為所有公開方法加上 span"""
+    def decorator(cls):
+        if _writer is None:
+            return cls
+        for attr, value in list(vars(cls).items()):
+            if not attr.startswith("_") and inspect.isfunction(value):
+                setattr(cls, attr, traced(category)(value))
+        return cls
+    return decorator
+
+
+def trace_sql_statements() -> None:
+    """為所有 engine 的每個 SQL 語句加上 span"""
+    if _writer is None:
+        return
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany):
+        conn.info.setdefault("trace_start_ns", []).append(time.perf_counter_ns())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, _cursor, statement, _parameters, _context, executemany):
+        start_ns = conn.info["trace_start_ns"].pop()
+        _writer.write("sql", "sql", start_ns, time.perf_counter_ns(), {
+            "statement": statement[:TRACE_SQL_MAX_LENGTH],
+            "executemany": executemany
+        })
+
+    @event.listens_for(Engine, "handle_error")
+    def _handle_error(context):
+        if context.connection is not None and context.connection.info.get("trace_start_ns"):
+            context.connection.info["trace_start_ns"].pop()
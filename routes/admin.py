@@ -0,0 +1,32 @@
+import asyncio
+import os
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from monitoring.profiler import PROFILE_MAX_SECONDS, ProfilerBusyError, sample_stacks
+from routes.message import get_user_from_request
+
+# 可使用管理端點的帳號（User.user_id，以逗號分隔）
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+
+router = APIRouter()
+
+
+@router.get("/profile")
+async def profile(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000)
+):
+    """對整個行程取樣 seconds 秒，回傳 folded stacks（可交給 flamegraph.pl 或 speedscope）"""
+    user = get_user_from_request(request)
+    if not user:
+        return JSONResponse({"error": "User not authenticated"}, status_code=401)
+    if user.user_id not in ADMIN_USER_IDS:
+        return JSONResponse({"error": "Permission denied"}, status_code=403)
+
+    # 取樣在背景執行緒進行，事件迴圈照常服務並一併被取樣
+    try:
+        folded = await asyncio.to_thread(sample_stacks, seconds, interval_ms / 1000)
+    except ProfilerBusyError:
+        return JSONResponse({"error": "A profile is already running"}, status_code=409)
+    return PlainTextResponse(folded)
@@ -0,0 +1,129 @@
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Dict, Hashable, List, Set
+from fastapi import WebSocket, WebSocketDisconnect
+
+
+# 心跳設定（秒）：閒置超過 PING_INTERVAL 送出 ping，超過 IDLE_TIMEOUT 視為斷線
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+WS_HEARTBEAT_TICK = float(os.getenv("WS_HEARTBEAT_TICK", "1"))
+# 關閉已失效連線時最多等待的秒數，避免卡在對端不回應的 TCP
+WS_CLOSE_TIMEOUT = 5.0
+
+
+class TimerWheel:
+    """
+    雜湊時間輪：所有連線共用一個 tick 推進的環狀陣列，
+    排程與取消皆為 O(1)，不需要每條連線各自一個計時 task
+    """
+
+    def __init__(self, tick: float, horizon: float):
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [
+            set() for _ in range(math.ceil(horizon / tick) + 1)]
+        self.cursor = 0
+        # key -> 所在 slot 的 index
+        self.positions: Dict[Hashable, int] = {}
+
+    def schedule(self, key: Hashable, delay: float) -> None:
+        self.cancel(key)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        index = (self.cursor + ticks) % len(self.slots)
+        self.slots[index].add(key)
+        self.positions[key] = index
+
+    def cancel(self, key: Hashable) -> None:
+        index = self.positions.pop(key, None)
+        if index is not None:
+            self.slots[index].discard(key)
+
+    def advance(self) -> Set[Hashable]:
+        """推進一格並回傳到期的 key"""
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        expired = self.slots[self.cursor]
+        self.slots[self.cursor] = set()
+        for key in expired:
+            self.positions.pop(key, None)
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+class HeartbeatMonitor:
+    """
+    伺服器端心跳：追蹤每條連線最後收到資料的時間，
+    閒置時送出 ping，逾時未回應則關閉連線並交給 on_dead 清理
+    """
+
+    PING = {"type": "ping"}
+
+    def __init__(self, on_dead: Callable[[WebSocket], None],
+                 ping_interval: float = WS_PING_INTERVAL,
+                 idle_timeout: float = WS_IDLE_TIMEOUT,
+                 tick: float = WS_HEARTBEAT_TICK):
+        self.on_dead = on_dead
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.wheel = TimerWheel(tick, max(ping_interval, idle_timeout))
+        # websocket -> 最後活動時間（time.monotonic）
+        self.last_seen: Dict[WebSocket, float] = {}
+        self._pending: Set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    def register(self, websocket: WebSocket) -> None:
+        self.last_seen[websocket] = time.monotonic()
+        self.wheel.schedule(websocket, self.ping_interval)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, websocket: WebSocket) -> None:
+        self.last_seen.pop(websocket, None)
+        self.wheel.cancel(websocket)
+
+    def touch(self, websocket: WebSocket) -> None:
+        """收到任何 frame 時呼叫；只更新時間戳記，不動時間輪"""
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = time.monotonic()
+
+    async def _run(self):
+        while self.last_seen:
+            await asyncio.sleep(self.wheel.tick)
+            now = time.monotonic()
+            for websocket in self.wheel.advance():
+                seen = self.last_seen.get(websocket)
+                if seen is None:
+                    continue
+                idle = now - seen
+                if idle >= self.idle_timeout:
+                    self.unregister(websocket)
+                    self.on_dead(websocket)
+                    self._spawn(self._close(websocket))
+                    continue
+                if idle >= self.ping_interval:
+                    self._spawn(self._ping(websocket))
+                    delay = min(self.ping_interval, self.idle_timeout - idle)
+                else:
+                    delay = self.ping_interval - idle
+                self.wheel.schedule(websocket, delay)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _ping(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.send_json(self.PING), WS_CLOSE_TIMEOUT)
+        except (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+            pass
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1001), WS_CLOSE_TIMEOUT)
+        except (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+            pass
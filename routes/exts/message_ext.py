@@ -1,69 +1,275 @@
 import asyncio
+import json
+import os
+import traceback
+from dataclasses import dataclass
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from fastapi import WebSocket, WebSocketDisconnect
 from database.models import User
-from typing import Dict, List
+from typing import Dict, List, Set
 from uuid import UUID
-from database.service import ChatRoomService, MessageService, get_user_by_id
-from database.database import get_session_context
+from database.service import ChatRoomService, MessageService
+from database.database import get_session_context, mark_user_write, run_read
+from routes.exts.heartbeat_ext import HeartbeatMonitor
+from monitoring.tracing import span
+
+
+# 每條連線同時處理中的 action 上限，超過時暫停讀取下一個 frame（背壓）
+MAX_INFLIGHT_ACTIONS = int(os.getenv("WS_MAX_INFLIGHT_ACTIONS", "8"))
+# 增量同步時每個聊天室每次最多回傳的訊息數，以及單次最多可同步的聊天室數
+SYNC_PAGE_SIZE = int(os.getenv("WS_SYNC_PAGE_SIZE", "100"))
+SYNC_MAX_ROOMS = int(os.getenv("WS_SYNC_MAX_ROOMS", "200"))
+# 同一使用者對同一聊天室的 mark_room_read 在此秒數內只寫入一次
+MARK_READ_DEBOUNCE = float(os.getenv("WS_MARK_READ_DEBOUNCE", "0.5"))
+# 單則訊息內容的位元組上限（UTF-8），超過時在寫入資料庫前拒絕
+MAX_MESSAGE_BYTES = int(os.getenv("MAX_MESSAGE_BYTES", "16384"))
+# 連線時的訂閱模式：all 訂閱全部、recent 只訂閱最近活躍的 N 個、none 全部由客戶端自行 subscribe
+RECENT_ROOMS = int(os.getenv("WS_RECENT_ROOMS", "50"))
+MAX_RECENT_ROOMS = int(os.getenv("WS_MAX_RECENT_ROOMS", "500"))
+# 記錄錯誤位置時只看專案內的呼叫堆疊
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@dataclass(frozen=True, slots=True)
+class ConnectionUser:
+    """連線期間持有的使用者紀錄，只保留識別資訊，不含密碼雜湊與 ORM 狀態"""
+    id: UUID
+    user_id: str
+    username: str
+
+    @classmethod
+    def from_user(cls, user: User) -> "ConnectionUser":
+        return cls(id=user.id, user_id=user.user_id, username=user.username)
 
 
 class ConnectManager:
     def __init__(self):
-        # chatroom_id -> list[WebSocket]
-        self.connections: Dict[UUID, List[WebSocket]] = {}
+        # chatroom_id -> set[WebSocket]，同時用來判斷連線是否已訂閱該聊天室
+        self.connections: Dict[UUID, Set[WebSocket]] = {}
+        # websocket -> 已訂閱的 chatroom_id，只用於斷線時清理這些聊天室（list 比 set 省記憶體）
+        self.subscriptions: Dict[WebSocket, List[UUID]] = {}
+        # user id -> 未訂閱全部所屬聊天室的連線，只有存在這類連線時才需要發送未讀通知
+        self.partial_users: Dict[UUID, List[WebSocket]] = {}
+        # websocket -> user，用於線上狀態查詢
+        self.users: Dict[WebSocket, ConnectionUser] = {}
+        # user id -> 該使用者的所有連線，用於推送成員異動
+        self.user_sockets: Dict[UUID, List[WebSocket]] = {}
+        # chatroom_id -> 同值的唯一 UUID 物件，讓各連線的 subscriptions 共用，而非各持一份
+        self.room_ids: Dict[UUID, UUID] = {}
+        self.heartbeat = HeartbeatMonitor(on_dead=self.disconnect)
+        # (user id, chatroom_id) -> 等待寫入的已讀標記
+        self.pending_reads: Dict[tuple[UUID, UUID], asyncio.Task] = {}
+        # 所有連線共用的 action 分派表
+        self.handlers = {
+            "send_message": self._handle_send_message,
+            "get_message": self._handle_get_message,
+            "mark_room_read": self._handle_mark_room_read,
+            "join_room": self._handle_join_room,
+            "leave_room": self._handle_leave_room,
+            "get_presence": self._handle_get_presence,
+            "sync": self._handle_sync,
+            "subscribe": self._handle_subscribe,
+            "unsubscribe": self._handle_unsubscribe
+        }
 
     ROOM_NOT_EXISTS = {"error": "room not exists"}
-    
-    async def add_connect(self, websocket: WebSocket, user: User):
+    INVALID_REQUEST = {"error": "invalid request"}
+    # 同一聊天室內需依序執行的 action，其餘（例如 get_message）可並行
+    ORDERED_ACTIONS = {"send_message", "mark_room_read", "join_room", "leave_room",
+                       "subscribe", "unsubscribe"}
+
+    async def add_connect(self, websocket: WebSocket, user: ConnectionUser,
+                          mode: str = "all", recent_limit: int = RECENT_ROOMS):
         """
         主連線進入點，負責分派不同的 action_type 到對應的處理器
+
+        每個 action 以獨立 task 執行，慢的查詢不會阻塞後續的 action；
+        同一聊天室的 ORDERED_ACTIONS 會串接前一個 task，保持送出順序。
         """
         await websocket.accept()
         # 初始化連線邏輯現在也封裝在內部
-        await self._initialize_connections(websocket, user)
+        await self._initialize_connections(websocket, user, mode, recent_limit)
 
-        handlers = {
-            "send_message": self._handle_send_message,
-            "get_message": self._handle_get_message,
-            "mark_room_read": self._handle_mark_room_read,
-            "join_room": self._handle_join_room,
-            "leave_room": self._handle_leave_room
-        }
+        self.users[websocket] = user
+        self._index_socket(self.user_sockets, user.id, websocket)
+        self.heartbeat.register(websocket)
+
+        # 閒置連線不配置這些結構，收到第一個 action 時才建立
+        tasks: Set[asyncio.Task] | None = None
+        # chatroom_id -> 該聊天室最後一個排序中的 task
+        room_tails: Dict[str, asyncio.Task] | None = None
+        graceful = False
 
         try:
             while True:
-                data: dict = await websocket.receive_json()
+                message = await websocket.receive_text()
+                self.heartbeat.touch(websocket)
+                # 格式錯誤的 frame 只回覆該請求，不中斷整條連線
+                try:
+                    with span("ws.decode_json", "websocket"):
+                        data: dict = json.loads(message)
+                except ValueError:
+                    data = None
+                if not isinstance(data, dict):
+                    await self._send(websocket, self.INVALID_REQUEST)
+                    continue
                 action_type = data.get("action_type")
-                
+                if not isinstance(action_type, str):
+                    await self._reply(websocket, data, self.INVALID_REQUEST)
+                    continue
+
                 if action_type == "disconnect":
+                    graceful = True
                     break
-                
-                handler = handlers.get(action_type)
-                if handler:
-                    # 統一使用 await 調用，架構非常整潔
-                    await handler(websocket, user, data)
-                else:
+                if action_type == "pong":
+                    continue
+
+                handler = self.handlers.get(action_type)
+                if not handler:
                     print(f"Unknown action type: {action_type}")
+                    continue
+
+                # chatroom_id 會作為排序用的 key 並轉為 UUID，必須是字串
+                if not isinstance(data.get("chatroom_id", ""), str):
+                    await self._reply(websocket, data, self.INVALID_REQUEST)
+                    continue
+                if tasks is None:
+                    tasks, room_tails = set(), {}
+                # 背壓：進行中的 action 達上限時等其中一個完成再讀下一個 frame
+                while len(tasks) >= MAX_INFLIGHT_ACTIONS:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                key = data.get("chatroom_id") if action_type in self.ORDERED_ACTIONS else None
+                previous = room_tails.get(key) if key is not None else None
+                task = asyncio.create_task(
+                    self._run_action(handler, websocket, user, data, previous))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if key is not None:
+                    room_tails[key] = task
+                    task.add_done_callback(
+                        lambda t, k=key: room_tails.pop(k, None) if room_tails.get(k) is t else None)
 
         except WebSocketDisconnect:
             pass
         finally:
+            # 主動斷線時等待進行中的 action 完成，連線中斷則直接取消
+            if not graceful:
+                for task in tasks or ():
+                    task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
             self.disconnect(websocket)
 
-    async def _initialize_connections(self, websocket: WebSocket, user: User):
-        """初始化使用者所屬聊天室的連線管理"""
-        def get_rooms():
-            with get_session_context() as session:
-                return ChatRoomService(session).get_chat_rooms_by_user(user)
-        
-        rooms = await asyncio.to_thread(get_rooms)  # 使用 to_thread 避免阻塞
-        for room in rooms:
-            self.connections.setdefault(room.id, []).append(websocket)
+    async def _run_action(self, handler, websocket: WebSocket, user: ConnectionUser, data: dict,
+                          previous: asyncio.Task | None):
+        """執行單一 action，錯誤只回報給該請求而不中斷整條連線"""
+        if previous is not None:
+            await asyncio.wait({previous})
+        try:
+            with span(f"ws.{data.get('action_type')}", "websocket"):
+                await handler(websocket, user, data)
+        except (KeyError, ValueError, TypeError) as e:
+            # 格式錯誤的請求與處理器本身的錯誤都會落在這裡，記下專案內最深的出錯位置以便區分
+            frame = [f for f in traceback.extract_tb(e.__traceback__) if f.filename.startswith(PROJECT_ROOT)][-1]
+            print(f"Invalid request for {data.get('action_type')}: {e!r} "
+                  f"at {frame.filename}:{frame.lineno} ({frame.name})")
+            await self._reply(websocket, data, self.INVALID_REQUEST)
+        except Exception as e:
+            print(f"Error handling {data.get('action_type')}: {e!r}")
+            await self._reply(websocket, data, {"error": "internal error"})
+
+    @staticmethod
+    async def _send(websocket: WebSocket, payload: dict):
+        """送出訊息，連線已關閉時忽略"""
+        try:
+            await websocket.send_json(payload)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    async def _reply(self, websocket: WebSocket, data: dict, payload: dict):
+        """回覆發出請求的連線，若請求帶有 request_id 則一併附上以便客戶端對應"""
+        if "request_id" in data:
+            payload = {**payload, "request_id": data["request_id"]}
+        await self._send(websocket, payload)
+
+    async def _ack(self, websocket: WebSocket, data: dict):
+        """沒有回應內容的 action 僅在帶有 request_id 時回傳確認"""
+        if "request_id" in data:
+            await self._reply(websocket, data, {"type": "ack", "action_type": data.get("action_type")})
+
+    async def _initialize_connections(self, websocket: WebSocket, user: ConnectionUser,
+                                      mode: str, recent_limit: int):
+        """
+        依訂閱模式初始化連線訂閱的聊天室；
+        recent / none 模式下連線成本與使用者所屬的聊天室數量無關
+        """
+        if mode != "all":
+            self._index_socket(self.partial_users, user.id, websocket)
+        if mode == "none":
+            return
+
+        limit = recent_limit if mode == "recent" else None
+
+        def get_room_ids(session):
+            return ChatRoomService(session).get_chat_room_ids_by_user(user.id, limit)
+
+        room_ids = await asyncio.to_thread(run_read, get_room_ids, user.id)  # 使用 to_thread 避免阻塞
+        for room_id in room_ids:
+            self._subscribe(websocket, room_id)
+
+    @staticmethod
+    def _index_socket(index: Dict[UUID, List[WebSocket]], user_id: UUID, websocket: WebSocket):
+        """多數使用者只有一條連線，以 list 而非 set 存放較省記憶體"""
+        sockets = index.setdefault(user_id, [])
+        if websocket not in sockets:
+            sockets.append(websocket)
+
+    @staticmethod
+    def _unindex_socket(index: Dict[UUID, List[WebSocket]], user_id: UUID, websocket: WebSocket):
+        sockets = index.get(user_id)
+        if sockets is not None and websocket in sockets:
+            sockets.remove(websocket)
+            if not sockets: index.pop(user_id, None)
+
+    def _is_subscribed(self, websocket: WebSocket, room_id: UUID) -> bool:
+        return websocket in self.connections.get(room_id, ())
+
+    def _subscribe(self, websocket: WebSocket, room_id: UUID):
+        sockets = self.connections.get(room_id)
+        if sockets is None:
+            sockets = self.connections[room_id] = set()
+            self.room_ids[room_id] = room_id
+        if websocket not in sockets:
+            sockets.add(websocket)
+            self.subscriptions.setdefault(websocket, []).append(self.room_ids[room_id])
+
+    def _unsubscribe(self, websocket: WebSocket, room_id: UUID):
+        sockets = self.connections.get(room_id)
+        if not sockets or websocket not in sockets:
+            return
+        sockets.discard(websocket)
+        if not sockets: self._drop_room(room_id)
+        subscribed = self.subscriptions.get(websocket)
+        if subscribed is not None:
+            subscribed.remove(room_id)
+            if not subscribed: self.subscriptions.pop(websocket, None)
+
+    def _drop_room(self, room_id: UUID):
+        self.connections.pop(room_id, None)
+        self.room_ids.pop(room_id, None)
 
-    async def _handle_send_message(self, websocket: WebSocket, user: User, data: dict):
+    async def _handle_send_message(self, websocket: WebSocket, user: ConnectionUser, data: dict):
         """處理發送訊息"""
         room_id = UUID(data["chatroom_id"])
         content = data["content"]
+        if not isinstance(content, str):
+            raise TypeError("content must be a string")
+        if len(content.encode("utf-8")) > MAX_MESSAGE_BYTES:
+            await self._reply(websocket, data, {"error": "message too large", "max_bytes": MAX_MESSAGE_BYTES})
+            return
+        # 只有存在部分訂閱的連線時才需要查詢成員以發送未讀通知
+        notify_unread = bool(self.partial_users)
         
         def process_db():
             with get_session_context() as session:
@@ -71,74 +277,170 @@ class ConnectManager:
                 message_service = MessageService(session)
                 room = chat_service.get_chat_room_by_id(room_id)
                 if not room:
-                    return None
+                    return None, []
                 new_msg = message_service.create_message(user, room, content)
-                author = get_user_by_id(session, new_msg.author_id)
-                return new_msg, author
+                member_ids = chat_service.get_member_ids(room_id) if notify_unread else []
+                # 作者即發送者，名稱直接取自連線紀錄，不必再查詢
+                return {
+                    "id": str(new_msg.id),
+                    "author_name": user.username,
+                    "content": content,
+                    "created_at": str(new_msg.created_at),
+                    "is_read": True,
+                    "seq": new_msg.seq
+                }, member_ids
 
-        result = await asyncio.to_thread(process_db)
-        if not result:
-            await websocket.send_json(self.ROOM_NOT_EXISTS)
+        message, member_ids = await asyncio.to_thread(process_db)
+        mark_user_write(user.id)
+        if not message:
+            await self._reply(websocket, data, self.ROOM_NOT_EXISTS)
             return
 
-        new_message, author = result
         response_payload = {
             "type": "message_list",
             "chatroom_id": str(room_id),
-            "messages": [{
-                "id": str(new_message.id),
-                "author_name": author.username if author else "Unknown",
-                "content": new_message.content,
-                "created_at": str(new_message.created_at),
-                "is_read": True
-            }]
+            "messages": [message]
         }
 
-        for ws in self.connections.get(room_id, []):
-            await ws.send_json(response_payload)
+        with span("ws.fanout", "websocket", room_id=str(room_id)):
+            for ws in list(self.connections.get(room_id, [])):
+                if ws is websocket:
+                    await self._reply(ws, data, response_payload)
+                else:
+                    await self._send(ws, response_payload)
+            # 發送者未訂閱該聊天室時仍需收到自己這則訊息的回覆
+            if not self._is_subscribed(websocket, room_id):
+                await self._reply(websocket, data, response_payload)
+            if member_ids:
+                await self._notify_unread(room_id, member_ids, message["seq"], websocket)
+
+    async def _notify_unread(self, room_id: UUID, member_ids: list[UUID], seq: int,
+                             sender: WebSocket):
+        """對在線但未訂閱該聊天室的連線只送出輕量的未讀通知，不含訊息內容"""
+        payload = {"type": "unread", "chatroom_id": str(room_id), "seq": seq}
+        # 只走訪成員與部分訂閱使用者中較小的一方
+        if len(self.partial_users) < len(member_ids):
+            members = set(member_ids)
+            user_ids = [uid for uid in self.partial_users if uid in members]
+        else:
+            user_ids = [uid for uid in member_ids if uid in self.partial_users]
+        for user_id in user_ids:
+            for ws in list(self.partial_users.get(user_id, ())):
+                if ws is not sender and not self._is_subscribed(ws, room_id):
+                    await self._send(ws, payload)
 
-    async def _handle_get_message(self, websocket: WebSocket, user: User, data: dict):
+    async def _handle_get_message(self, websocket: WebSocket, user: ConnectionUser, data: dict):
         """處理獲取歷史訊息"""
         room_id = UUID(data["chatroom_id"])
         limit = data.get("limit", 50)
         before = data.get("before_created_at")
+        if before is not None:
+            # 格式錯誤時拋出 ValueError / TypeError，回覆 invalid request；
+            # 訊息時間以台北時間存放，帶時區的游標先換算再比較
+            before = datetime.fromisoformat(before)
+            if before.tzinfo is not None:
+                before = before.astimezone(ZoneInfo("Asia/Taipei")).replace(tzinfo=None)
+        before_id = UUID(data["before_id"]) if data.get("before_id") else None
 
-        def fetch_msgs():
-            with get_session_context() as session:
-                chat_service = ChatRoomService(session)
-                if not chat_service.get_chat_room_by_id(room_id):
-                    return None
-                return MessageService(session).get_messages_by_room(
-                    room_id=room_id, user_id=user.id, limit=limit, before_created_at=before
-                )
+        def fetch_msgs(session):
+            chat_service = ChatRoomService(session)
+            if not chat_service.get_chat_room_by_id(room_id):
+                return None
+            return MessageService(session).get_messages_by_room(
+                room_id=room_id, user_id=user.id, limit=limit, before_created_at=before,
+                before_id=before_id
+            )
 
-        messages = await asyncio.to_thread(fetch_msgs)
+        messages = await asyncio.to_thread(run_read, fetch_msgs, user.id)
         if messages is None:
-            await websocket.send_json(self.ROOM_NOT_EXISTS)
+            await self._reply(websocket, data, self.ROOM_NOT_EXISTS)
             return
 
-        await websocket.send_json({
+        await self._reply(websocket, data, {
             "type": "message_list",
             "chatroom_id": str(room_id),
             "messages": [{"id": str(m.id), "author_name": m.author_name, "content": m.content, 
-                          "created_at": str(m.created_at), "is_read": m.is_read} for m in messages]
+                          "created_at": str(m.created_at), "is_read": m.is_read, "seq": m.seq}
+                         for m in messages]
         })
 
-    async def _handle_mark_room_read(self, _websocket: WebSocket, user: User, data: dict):
-        """處理標記聊天室為已讀"""
+    async def _handle_sync(self, websocket: WebSocket, user: ConnectionUser, data: dict):
+        """
+        處理重新連線後的增量同步：客戶端送出各聊天室最後看到的序號，
+        只回傳之後的訊息；has_more 為 true 時以 next_seq 再次同步取得下一頁
+        """
+        cursors = {UUID(room_id): int(seq) for room_id, seq in data["rooms"].items()}
+        if len(cursors) > SYNC_MAX_ROOMS:
+            await self._reply(websocket, data, {"error": "too many rooms", "max_rooms": SYNC_MAX_ROOMS})
+            return
+        limit = max(1, min(int(data.get("limit", SYNC_PAGE_SIZE)), SYNC_PAGE_SIZE))
+
+        def fetch_deltas(session):
+            message_service = MessageService(session)
+            latest = message_service.get_latest_seqs(user.id, list(cursors))
+            # 多取一筆用來判斷是否還有下一頁
+            deltas = {
+                room_id: message_service.get_messages_after_seq(
+                    room_id, user.id, cursors[room_id], limit + 1)
+                for room_id, latest_seq in latest.items() if latest_seq > cursors[room_id]
+            }
+            return latest, deltas
+
+        latest, deltas = await asyncio.to_thread(run_read, fetch_deltas, user.id)
+
+        rooms = []
+        for room_id, latest_seq in latest.items():
+            messages = deltas.get(room_id, [])
+            page = messages[:limit]
+            rooms.append({
+                "chatroom_id": str(room_id),
+                "from_seq": cursors[room_id],
+                "latest_seq": latest_seq,
+                "next_seq": page[-1].seq if page else cursors[room_id],
+                "has_more": len(messages) > limit,
+                "messages": [{"id": str(m.id), "author_name": m.author_name, "content": m.content,
+                              "created_at": str(m.created_at), "is_read": m.is_read, "seq": m.seq,
+                              "is_deleted": m.is_deleted} for m in page]
+            })
+
+        await self._reply(websocket, data, {
+            "type": "sync",
+            "rooms": rooms,
+            # 不存在或已不是成員的聊天室，客戶端應自行移除
+            "missing_rooms": [str(room_id) for room_id in cursors if room_id not in latest]
+        })
+
+    async def _handle_mark_room_read(self, websocket: WebSocket, user: ConnectionUser, data: dict):
+        """處理標記聊天室為已讀：視窗內重複的標記合併為一次寫入"""
         room_id = UUID(data["chatroom_id"])
+        key = (user.id, room_id)
+        if key not in self.pending_reads:
+            self.pending_reads[key] = asyncio.create_task(self._flush_room_read(key))
+        await self._ack(websocket, data)
+
+    async def _flush_room_read(self, key: tuple[UUID, UUID]):
+        """等待合併視窗結束後寫入已讀；寫入開始後收到的標記會排入下一次寫入"""
+        user_id, room_id = key
+        await asyncio.sleep(MARK_READ_DEBOUNCE)
+        self.pending_reads.pop(key, None)
+
         def do_mark():
             with get_session_context() as session:
-                MessageService(session).mark_room_as_read(user.id, room_id)
-        
-        await asyncio.to_thread(do_mark)
+                MessageService(session).mark_room_as_read(user_id, room_id)
+
+        try:
+            await asyncio.to_thread(do_mark)
+        except Exception as e:
+            print(f"Error marking room {room_id} as read: {e!r}")
+            return
+        mark_user_write(user_id)
 
-    async def _handle_join_room(self, websocket: WebSocket, user: User, data: dict):
+    async def _handle_join_room(self, websocket: WebSocket, user: ConnectionUser, data: dict):
         """處理加入新聊天室"""
         try:
             room_id = UUID(data["chatroom_id"])
         except (ValueError, KeyError):
-            await websocket.send_json({"error": "invalid room id"})
+            await self._reply(websocket, data, {"error": "invalid room id"})
             return
 
         def do_join():
@@ -146,21 +448,22 @@ class ConnectManager:
                 chat_service = ChatRoomService(session)
                 room = chat_service.get_chat_room_by_id(room_id)
                 if not room: return False
-                if user not in room.members:
+                if not chat_service.is_user_in_chat_room(user.id, room_id):
                     chat_service.add_user_to_chat_room(user, room)
                 return True
 
-        if await asyncio.to_thread(do_join):
-            self.connections.setdefault(room_id, []).append(websocket)
+        joined = await asyncio.to_thread(do_join)
+        mark_user_write(user.id)
+        if joined:
+            self._subscribe(websocket, room_id)
+            await self._ack(websocket, data)
         else:
-            await websocket.send_json(self.ROOM_NOT_EXISTS)
+            await self._reply(websocket, data, self.ROOM_NOT_EXISTS)
 
-    async def _handle_leave_room(self, websocket: WebSocket, user: User, data: dict):
+    async def _handle_leave_room(self, websocket: WebSocket, user: ConnectionUser, data: dict):
         """處理離開聊天室"""
         room_id = UUID(data["chatroom_id"])
-        if room_id in self.connections and websocket in self.connections[room_id]:
-            self.connections[room_id].remove(websocket)
-            if not self.connections[room_id]: self.connections.pop(room_id)
+        self._unsubscribe(websocket, room_id)
 
         def do_leave():
             with get_session_context() as session:
@@ -169,10 +472,88 @@ class ConnectManager:
                 if room: chat_service.remove_user_from_chat_room(user, room)
 
         await asyncio.to_thread(do_leave)
+        mark_user_write(user.id)
+        await self._ack(websocket, data)
+
+    async def _handle_get_presence(self, websocket: WebSocket, user: ConnectionUser, data: dict):
+        """處理查詢聊天室線上成員，只允許該聊天室的成員查詢（不論是否已訂閱）"""
+        room_id = UUID(data["chatroom_id"])
+
+        def get_members(session):
+            return ChatRoomService(session).get_member_ids(room_id)
+
+        member_ids = await asyncio.to_thread(run_read, get_members, user.id)
+        if user.id not in member_ids:
+            await self._reply(websocket, data, self.ROOM_NOT_EXISTS)
+            return
+
+        await self._reply(websocket, data, {
+            "type": "presence",
+            "chatroom_id": str(room_id),
+            "online_users": [{"id": str(u.id), "user_id": u.user_id, "username": u.username}
+                             for u in self.get_online_users(member_ids)]
+        })
+
+    async def _handle_subscribe(self, websocket: WebSocket, user: ConnectionUser, data: dict):
+        """處理訂閱聊天室：只改變此連線是否接收該聊天室的訊息，不異動成員資格"""
+        room_id = UUID(data["chatroom_id"])
+        if not self._is_subscribed(websocket, room_id):
+            def is_member(session):
+                return ChatRoomService(session).is_user_in_chat_room(user.id, room_id)
+
+            if not await asyncio.to_thread(run_read, is_member, user.id):
+                await self._reply(websocket, data, self.ROOM_NOT_EXISTS)
+                return
+            self._subscribe(websocket, room_id)
+        await self._ack(websocket, data)
+
+    async def _handle_unsubscribe(self, websocket: WebSocket, user: ConnectionUser, data: dict):
+        """處理取消訂閱：之後該聊天室的新訊息改以未讀通知告知"""
+        room_id = UUID(data["chatroom_id"])
+        self._unsubscribe(websocket, room_id)
+        self._index_socket(self.partial_users, user.id, websocket)
+        await self._ack(websocket, data)
+
+    def get_online_users(self, member_ids: list[UUID]) -> list[ConnectionUser]:
+        """
+        回傳目前有連線的成員（同一使用者多條連線只算一次）；
+        不看訂閱，subscribe=none 或未訂閱該聊天室的連線也算在線
+        """
+        online: list[ConnectionUser] = []
+        for member_id in dict.fromkeys(member_ids):
+            for ws in self.user_sockets.get(member_id, ()):
+                user = self.users.get(ws)
+                if user is not None:
+                    online.append(user)
+                    break
+        return online
+
+    async def subscribe_users(self, room_id: UUID, user_ids: list[UUID]):
+        """成員被加入聊天室後，讓其在線的連線開始接收該聊天室的訊息並通知客戶端"""
+        payload = {"type": "room_joined", "chatroom_id": str(room_id)}
+        for user_id in user_ids:
+            for ws in list(self.user_sockets.get(user_id, ())):
+                self._subscribe(ws, room_id)
+                await self._send(ws, payload)
+
+    async def unsubscribe_users(self, room_id: UUID, user_ids: list[UUID]):
+        """成員被移出聊天室後，停止其在線連線的訂閱並通知客戶端"""
+        payload = {"type": "room_left", "chatroom_id": str(room_id)}
+        for user_id in user_ids:
+            for ws in list(self.user_sockets.get(user_id, ())):
+                self._unsubscribe(ws, room_id)
+                await self._send(ws, payload)
 
     def disconnect(self, websocket: WebSocket):
         """清理連線"""
-        rooms_to_cleanup = [rid for rid, ws_list in self.connections.items() if websocket in ws_list]
-        for rid in rooms_to_cleanup:
-            self.connections[rid].remove(websocket)
-            if not self.connections[rid]: self.connections.pop(rid, None)
\ No newline at end of file
+        user = self.users.pop(websocket, None)
+        if user is not None:
+            self._unindex_socket(self.user_sockets, user.id, websocket)
+            self._unindex_socket(self.partial_users, user.id, websocket)
+        self.heartbeat.unregister(websocket)
+        # 只走訪此連線訂閱的聊天室，而非掃描所有聊天室
+        for rid in self.subscriptions.pop(websocket, ()):
+            sockets = self.connections.get(rid)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets: self._drop_room(rid)
\ No newline at end of file
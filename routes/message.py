@@ -1,25 +1,65 @@
-from fastapi import APIRouter, WebSocket, Request, Depends, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+import asyncio
+import csv
+import io
+import json
+from typing import Literal
+from uuid import UUID
+from fastapi import APIRouter, WebSocket, Request, Query, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from database.database import get_session
-from database.service import add_user_to_chat_room, create_chat_room, get_chat_rooms_by_user
+from database.database import get_read_session_context, get_session_context, mark_user_write, run_read
+from database.service import (
+    add_users_to_chat_room, create_chat_room_with_members, get_chat_room_by_id, get_chat_rooms_by_user,
+    get_member_ids, get_users_by_user_ids, is_user_in_chat_room, iter_messages_for_export, remove_users_from_chat_room
+)
 from database.models import ChatRoom
 from auth.user_auth import get_current_user
-from routes.exts.message_ext import ConnectManager
+from routes.exts.message_ext import MAX_RECENT_ROOMS, RECENT_ROOMS, ConnectManager, ConnectionUser
 
 router = APIRouter()
 connect_manager = ConnectManager()
 
+# 匯出時每批從資料庫取出並一起寫出的訊息數
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CSV_HEADER = ["seq", "id", "author_name", "content", "created_at"]
+# 單次請求最多可異動的成員數
+MAX_BULK_MEMBERS = 1000
+
 
 class CreateRoomRequest(BaseModel):
     room_name: str | None = None
+    # 建立時一併加入的成員（User.user_id），建立者會自動加入
+    member_user_ids: list[str] = []
+
+
+class UpdateMembersRequest(BaseModel):
+    add: list[str] = []
+    remove: list[str] = []
 
 
 class GetRoomsResponse(BaseModel):
     room_ids: dict[str, str]
 
 
+class OnlineUser(BaseModel):
+    id: str
+    user_id: str
+    username: str
+
+
+class GetPresenceResponse(BaseModel):
+    chatroom_id: str
+    online_users: list[OnlineUser]
+
+
 # ---------------- Helper ----------------
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
 def _parse_cookie_header(cookie_header: str | None) -> dict:
     if not cookie_header:
         return {}
@@ -54,9 +94,42 @@ def get_user_from_request(request: Request):
     return get_current_user(token)
 
 
+def _iter_export_chunks(room_id: UUID, user_id: UUID, export_format: str, after_seq: int):
+    """將訊息逐批編碼為 NDJSON 或 CSV 文字區塊，整個匯出期間只持有一批資料"""
+    with get_read_session_context(user_id) as session:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(EXPORT_CSV_HEADER)
+
+        count = 0
+        for seq, message_id, author_name, content, created_at in iter_messages_for_export(
+                session, room_id, after_seq, EXPORT_BATCH_SIZE):
+            if export_format == "csv":
+                writer.writerow([seq, message_id, author_name, content, created_at.isoformat()])
+            else:
+                buffer.write(json.dumps({
+                    "seq": seq,
+                    "id": str(message_id),
+                    "author_name": author_name,
+                    "content": content,
+                    "created_at": created_at.isoformat()
+                }, ensure_ascii=False))
+                buffer.write("\n")
+
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
 # ---------------- WebSocket ----------------
-@router.websocket("/online")
-async def websocket_online(websocket: WebSocket, token: str | None = None):
+def _authenticate_websocket(websocket: WebSocket, token: str | None) -> ConnectionUser | None:
+    """驗證 WebSocket 連線，只回傳精簡的使用者紀錄，ORM 物件不會被長連線持有"""
     user = get_current_user(token) if token else None
 
     # token 從 cookie/header 再試一次
@@ -71,38 +144,149 @@ async def websocket_online(websocket: WebSocket, token: str | None = None):
                 token = auth_header.split(" ", 1)[1]
         user = get_current_user(token)
 
+    return ConnectionUser.from_user(user) if user else None
+
+
+@router.websocket("/online")
+async def websocket_online(
+    websocket: WebSocket,
+    token: str | None = None,
+    subscribe: Literal["all", "recent", "none"] = "all",
+    recent_limit: int = Query(RECENT_ROOMS, ge=1, le=MAX_RECENT_ROOMS)
+):
+    user = _authenticate_websocket(websocket, token)
     if not user:
         await websocket.close(code=1008)
         return
 
-    await connect_manager.add_connect(websocket, user)
+    await connect_manager.add_connect(websocket, user, subscribe, recent_limit)
 
 
 # ---------------- HTTP API ----------------
+# 以下 async 路由的資料庫操作都以 to_thread 執行，並在 await 之前結束 session；
+# 在事件迴圈上持有連線（SQLite 為唯一的寫入連線）會讓其他請求卡在取得連線
 @router.post("/create_room")
-async def create_room(
-    request_data: CreateRoomRequest,
-    request: Request,
-    session=Depends(get_session)
-):
-    user = get_user_from_request(request)
+async def create_room(request_data: CreateRoomRequest, request: Request):
+    user = await asyncio.to_thread(get_user_from_request, request)
     if not user:
         return JSONResponse({"error": "User not authenticated"}, status_code=401)
 
-    room_name = request_data.room_name or f"room_{user.user_id}"
-    room = ChatRoom(name=room_name)
-    create_chat_room(session, room)
-    add_user_to_chat_room(session, user, room)
+    if len(request_data.member_user_ids) > MAX_BULK_MEMBERS:
+        return JSONResponse({"error": f"Too many members (max {MAX_BULK_MEMBERS})"}, status_code=400)
+
+    def do_create():
+        with get_session_context() as session:
+            members = get_users_by_user_ids(session, request_data.member_user_ids)
+            member_ids = list(dict.fromkeys([user.id, *(member.id for member in members)]))
+            room_name = request_data.room_name or f"room_{user.user_id}"
+            room = create_chat_room_with_members(session, ChatRoom(name=room_name), member_ids)
+            return room.id, member_ids, {member.user_id for member in members}
+
+    room_id, member_ids, found = await asyncio.to_thread(do_create)
+    for member_id in member_ids:
+        mark_user_write(member_id)
+    await connect_manager.subscribe_users(room_id, member_ids)
 
-    return {"room_id": str(room.id)}
+    return {
+        "room_id": str(room_id),
+        "unknown_user_ids": [uid for uid in request_data.member_user_ids if uid not in found]
+    }
+
+
+@router.post("/room_members/{room_id}")
+async def update_room_members(room_id: UUID, request_data: UpdateMembersRequest, request: Request):
+    """批次加入/移除聊天室成員（需為該聊天室成員），並同步更新在線成員的訂閱"""
+    user = await asyncio.to_thread(get_user_from_request, request)
+    if not user:
+        return JSONResponse({"error": "User not authenticated"}, status_code=401)
+    if len(request_data.add) + len(request_data.remove) > MAX_BULK_MEMBERS:
+        return JSONResponse({"error": f"Too many members (max {MAX_BULK_MEMBERS})"}, status_code=400)
+
+    def do_update():
+        with get_session_context() as session:
+            room = get_chat_room_by_id(session, room_id)
+            if not room or not is_user_in_chat_room(session, user.id, room_id):
+                return None
+            users = {u.user_id: u.id for u in get_users_by_user_ids(session, request_data.add + request_data.remove)}
+            to_add = [users[uid] for uid in request_data.add if uid in users]
+            to_remove = [users[uid] for uid in request_data.remove if uid in users]
+            added = add_users_to_chat_room(session, room, to_add)
+            removed = remove_users_from_chat_room(session, room, to_remove)
+            return users, added, removed
+
+    result = await asyncio.to_thread(do_update)
+    if result is None:
+        return JSONResponse({"error": "room not exists"}, status_code=404)
+    users, added, removed = result
+    user_id_by_id = {uid: user_id for user_id, uid in users.items()}
+    for member_id in (*added, *removed):
+        mark_user_write(member_id)
+    await connect_manager.subscribe_users(room_id, added)
+    await connect_manager.unsubscribe_users(room_id, removed)
+
+    return {
+        "added": [user_id_by_id[uid] for uid in added],
+        "removed": [user_id_by_id[uid] for uid in removed],
+        "unknown_user_ids": [uid for uid in request_data.add + request_data.remove if uid not in users]
+    }
 
 
 @router.get("/get_rooms")
-async def get_rooms(request: Request, session=Depends(get_session)):
+async def get_rooms(request: Request, response: Response):
     user = get_user_from_request(request)
     if not user:
         return JSONResponse({"error": "User not authenticated"}, status_code=401)
 
-    rooms = get_chat_rooms_by_user(session, user)
+    # 成員版本隨驗證時載入的使用者一起取得，比對 ETag 不需查詢聊天室表格
+    etag = f'"{user.id.hex}-{user.membership_version}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    response.headers.update(cache_headers)
+
+    rooms = run_read(lambda session: get_chat_rooms_by_user(session, user), user.id)
     room_ids = {str(room.id): room.name for room in rooms}
     return GetRoomsResponse(room_ids=room_ids)
+
+
+@router.get("/presence/{room_id}")
+async def get_presence(room_id: UUID, request: Request):
+    user = await asyncio.to_thread(get_user_from_request, request)
+    if not user:
+        return JSONResponse({"error": "User not authenticated"}, status_code=401)
+
+    member_ids = await asyncio.to_thread(run_read, lambda session: get_member_ids(session, room_id), user.id)
+    if user.id not in member_ids:
+        return JSONResponse({"error": "room not exists"}, status_code=404)
+
+    online_users = [
+        OnlineUser(id=str(u.id), user_id=u.user_id, username=u.username)
+        for u in connect_manager.get_online_users(member_ids)
+    ]
+    return GetPresenceResponse(chatroom_id=str(room_id), online_users=online_users)
+
+
+@router.get("/export/{room_id}")
+async def export_room_history(
+    room_id: UUID,
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    after_seq: int = 0
+):
+    """
+    串流匯出聊天室歷史訊息（chunked transfer）。
+    每則訊息都帶有 seq，中斷後以最後收到的 seq 作為 after_seq 即可續傳
+    """
+    user = get_user_from_request(request)
+    if not user:
+        return JSONResponse({"error": "User not authenticated"}, status_code=401)
+
+    if not run_read(lambda session: is_user_in_chat_room(session, user.id, room_id), user.id):
+        return JSONResponse({"error": "room not exists"}, status_code=404)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _iter_export_chunks(room_id, user.id, format, after_seq),
+        media_type=f"{media_type}; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="room_{room_id}.{format}"'}
+    )
@@ -1,15 +1,21 @@
 from auth.user_auth import get_current_user, create_access_token, create_refresh_token, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
-from database.service import get_user_by_user_id, create_user
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from database.service import get_user_by_user_id, create_user, search_users
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
 from fastapi.responses import JSONResponse, RedirectResponse
-from database.database import get_session
+from database.database import get_session, run_read
 from auth.user_factory import get_a_new_user, verify_user_password
+from routes.exts.cache_ext import TTLCache
 from sqlmodel import Session
 import pydantic
 import os
 
 # 控制 cookie 的 secure 屬性（開發時預設 False，生產環境請設定環境變數 COOKIE_SECURE=true）
 COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").lower() == "true"
+# 使用者搜尋結果的快取秒數與筆數，吸收輸入時連續送出的相同查詢
+USER_SEARCH_CACHE_TTL = float(os.getenv("USER_SEARCH_CACHE_TTL", "5"))
+USER_SEARCH_CACHE_SIZE = int(os.getenv("USER_SEARCH_CACHE_SIZE", "1024"))
+USER_SEARCH_MAX_LIMIT = 50
+USER_SEARCH_MAX_OFFSET = 1000
 
 class UserResponseModel(pydantic.BaseModel):
     id: str
@@ -25,7 +31,13 @@ class UserRegisterForm(pydantic.BaseModel):
     username: str
     password: str
 
+class UserSearchResponse(pydantic.BaseModel):
+    users: list[UserResponseModel]
+    # 沒有下一頁時為 None
+    next_offset: int | None
+
 router = APIRouter()
+search_cache = TTLCache(USER_SEARCH_CACHE_SIZE, USER_SEARCH_CACHE_TTL)
 
 
 @router.post("/login", response_model=UserResponseModel)
@@ -122,4 +134,28 @@ def register_user(user: UserRegisterForm, session: Session = Depends(get_session
 
     new_user = get_a_new_user(user.user_id, user.username, user.password)
     created = create_user(session, new_user)
-    return JSONResponse(content={"id": str(created.id), "user_id": created.user_id, "username": created.username}, status_code=status.HTTP_201_CREATED)
\ No newline at end of file
+    return JSONResponse(content={"id": str(created.id), "user_id": created.user_id, "username": created.username}, status_code=status.HTTP_201_CREATED)
+
+
+@router.get("/search", response_model=UserSearchResponse)
+def search_user(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=20),
+    limit: int = Query(20, ge=1, le=USER_SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0, le=USER_SEARCH_MAX_OFFSET)
+):
+    user = get_current_user(request.cookies.get("access_token"))
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not authenticated")
+
+    key = (q.strip().lower(), limit, offset)
+    result = search_cache.get(key)
+    if result is None:
+        # 多取一筆以判斷是否還有下一頁
+        users = run_read(lambda session: search_users(session, q, limit + 1, offset), user.id)
+        result = {
+            "users": [{"id": str(u.id), "user_id": u.user_id, "username": u.username} for u in users[:limit]],
+            "next_offset": offset + limit if len(users) > limit else None
+        }
+        search_cache.set(key, result)
+    return result
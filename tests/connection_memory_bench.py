@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from fastapi import WebSocketDisconnect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description="量測每條閒置 WebSocket 連線在伺服器端佔用的記憶體（會寫入測試資料，請勿對正式資料庫執行）")
+parser.add_argument("--url", default="sqlite://", help="覆寫 DATABASE_URL，預設為記憶體內的 SQLite")
+parser.add_argument("--connections", type=int, default=10_000)
+parser.add_argument("--rooms", type=int, default=3, help="每個使用者所屬的聊天室數")
+parser.add_argument("--subscribe", choices=["all", "recent", "none"], default="all")
+args = parser.parse_args()
+# 必須在匯入 database.database 之前設定，engine 於匯入時建立
+os.environ["DATABASE_URL"] = args.url
+
+from sqlalchemy import insert
+from sqlmodel import select
+from database.database import create_db_and_tables, engine, get_session_context
+from database.models import ChatRoom, ChatRoomPivot, User, uuid7
+from database.service import ChatRoomService
+from routes.exts.message_ext import ConnectManager, ConnectionUser
+
+
+class IdleWebSocket:
+    """只接受連線、之後不再送出任何 frame 的假連線"""
+
+    def __init__(self):
+        self.closed = asyncio.get_running_loop().create_future()
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        return await self.closed
+
+    async def receive_json(self):
+        return await self.closed
+
+    async def send_json(self, payload):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class LegacyConnectManager:
+    """先前版本的連線管理（聊天室 -> list、每條連線一份 handlers dict 並持有 ORM User），作為比較基準"""
+
+    def __init__(self):
+        self.connections: dict = {}
+        self.users: list = []
+
+    async def add_connect(self, websocket, user: User):
+        await websocket.accept()
+
+        def get_rooms():
+            with get_session_context() as session:
+                return ChatRoomService(session).get_chat_rooms_by_user(user)
+
+        for room in await asyncio.to_thread(get_rooms):
+            self.connections.setdefault(room.id, []).append(websocket)
+        self.users.append(user)
+        handlers = {name: self.add_connect for name in
+                    ("send_message", "get_message", "mark_room_read", "join_room", "leave_room")}
+        try:
+            while True:
+                data = await websocket.receive_json()
+                handler = handlers.get(data.get("action_type"))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for sockets in self.connections.values():
+                if websocket in sockets:
+                    sockets.remove(websocket)
+
+
+def seed(users: int, rooms: int) -> list[tuple]:
+    prefix = f"mem_{time.time_ns() % 10 ** 8}_"
+    user_rows = [{"id": uuid7(), "user_id": f"{prefix}{i}", "username": f"Bench {i}",
+                  "hash_password": "x" * 64, "salt": "x" * 32, "membership_version": 0} for i in range(users)]
+    room_rows = [{"id": uuid7(), "name": f"{prefix}{i}", "last_seq": 0} for i in range(max(1, users // 10))]
+    pivot_rows = [{"id": uuid7(), "user_id": user["id"], "chatroom_id": room_rows[(i + r) % len(room_rows)]["id"]}
+                  for i, user in enumerate(user_rows) for r in range(rooms)]
+    with engine.begin() as conn:
+        conn.execute(insert(User), user_rows)
+        conn.execute(insert(ChatRoom), room_rows)
+        conn.execute(insert(ChatRoomPivot), pivot_rows)
+    return [(row["id"], row["user_id"], row["username"]) for row in user_rows]
+
+
+def measure(func) -> int:
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = func()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    del kept
+    return used
+
+
+def orm_users(user_ids: list) -> list[User]:
+    """舊做法：每條連線持有一個從 session 取出的 ORM User"""
+    with get_session_context() as session:
+        users = list(session.exec(select(User).where(User.id.in_(user_ids))).all())
+        session.expunge_all()
+    return users
+
+
+async def open_connections(manager: ConnectManager, sockets: list, users: list) -> list[asyncio.Task]:
+    tasks = [asyncio.create_task(manager.add_connect(ws, ConnectionUser(*user), args.subscribe))
+             for ws, user in zip(sockets, users)]
+    # 等所有連線完成初始化並停在 receive_text
+    while len(manager.users) < len(tasks):
+        await asyncio.sleep(0.01)
+    return tasks
+
+
+async def open_legacy_connections(manager: LegacyConnectManager, sockets: list, users: list) -> list[asyncio.Task]:
+    # 舊版在路由中取出 ORM User 並於整條連線期間持有，一併計入
+    records = orm_users([user[0] for user in users])
+    tasks = [asyncio.create_task(manager.add_connect(ws, user)) for ws, user in zip(sockets, records)]
+    while len(manager.users) < len(tasks):
+        await asyncio.sleep(0.01)
+    return tasks
+
+
+async def measure_connections(open_func, manager, users: list) -> int:
+    # 假連線本身不屬於伺服器端的成本，先建立好再開始量測
+    sockets = [IdleWebSocket() for _ in users]
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    tasks = await open_func(manager, sockets, users)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    for ws in sockets:
+        ws.closed.set_exception(WebSocketDisconnect())
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return used
+
+
+async def main():
+    create_db_and_tables()
+    users = seed(args.connections, args.rooms)
+
+    tracemalloc.start()
+    used = await measure_connections(open_connections, ConnectManager(), users)
+    legacy = await measure_connections(open_legacy_connections, LegacyConnectManager(), users)
+
+    sample = [user[0] for user in users[:1000]]
+    record = measure(lambda: [ConnectionUser(*user) for user in users[:1000]]) / len(sample)
+    orm = measure(lambda: orm_users(sample)) / len(sample)
+    tracemalloc.stop()
+
+    print(f"connections={len(users)} rooms_per_user={args.rooms} subscribe={args.subscribe}")
+    print(f"per idle connection: {used / len(users):8.0f} bytes (total {used / 1024 / 1024:.1f}MiB)")
+    print(f"previous design:     {legacy / len(users):8.0f} bytes (total {legacy / 1024 / 1024:.1f}MiB)")
+    print(f"user record per connection: ConnectionUser={record:6.0f} bytes, ORM User={orm:6.0f} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
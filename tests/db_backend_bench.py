@@ -0,0 +1,69 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description="比較資料庫後端的讀寫延遲（會寫入測試資料，請勿對正式資料庫執行）")
+parser.add_argument("--url", help="覆寫 DATABASE_URL，例如 sqlite:///bench.db 或 postgresql://...")
+parser.add_argument("--threads", type=int, default=16)
+parser.add_argument("--messages", type=int, default=2000)
+parser.add_argument("--reads", type=int, default=2000)
+args = parser.parse_args()
+# 必須在匯入 database.database 之前設定，engine 於匯入時建立
+if args.url:
+    os.environ["DATABASE_URL"] = args.url
+
+from database.database import create_db_and_tables, engine, get_read_session_context, get_session_context
+from database.models import ChatRoom, User
+from database.service import ChatRoomService, MessageService, create_user
+
+
+def setup(users: int) -> tuple[list[UUID], UUID]:
+    with get_session_context() as session:
+        members = [create_user(session, User(user_id=f"bench_{time.time_ns()}_{i}", username=f"Bench {i}",
+                                             hash_password="x", salt="x")).id for i in range(users)]
+        room = ChatRoomService(session).create_chat_room_with_members(ChatRoom(name="bench"), members)
+        return members, room.id
+
+
+def timed(func, count: int) -> list[float]:
+    def run(i):
+        started = time.perf_counter()
+        func(i)
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        return sorted(pool.map(run, range(count)))
+
+
+def report(name: str, timings: list[float], elapsed: float):
+    print(f"{name:6} n={len(timings):5} {len(timings) / elapsed:8.0f}/s "
+          f"p50={statistics.median(timings):7.2f}ms p95={timings[int(len(timings) * 0.95) - 1]:7.2f}ms "
+          f"max={timings[-1]:7.2f}ms")
+
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    member_ids, room_id = setup(args.threads)
+    print(f"backend={engine.dialect.name} threads={args.threads}")
+
+    def write(i):
+        # 與 WebSocket send_message 相同：先讀聊天室再寫入訊息與已讀紀錄
+        with get_session_context() as session:
+            chat_room = ChatRoomService(session).get_chat_room_by_id(room_id)
+            author = session.get(User, member_ids[i % len(member_ids)])
+            MessageService(session).create_message(author, chat_room, f"message {i}")
+
+    def read(i):
+        with get_read_session_context() as session:
+            MessageService(session).get_messages_by_room(room_id, member_ids[i % len(member_ids)], limit=50)
+
+    started = time.perf_counter()
+    report("write", timed(write, args.messages), time.perf_counter() - started)
+    started = time.perf_counter()
+    report("read", timed(read, args.reads), time.perf_counter() - started)
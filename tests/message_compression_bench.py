@@ -0,0 +1,98 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func
+from sqlmodel import Session, SQLModel, create_engine, select
+import database.models as models
+from database.models import ChatRoom, Message, User
+from database.service import ChatRoomService, MessageService, create_user
+
+WORDS = ("the a to and of you i it is that in we for on this my be have with can just "
+         "meeting deploy server tomorrow thanks please check review build error fix today "
+         "lunch weekend update ticket branch merge test release customer issue ok yes no").split()
+LOG_LINE = "2024-05-01T12:{:02d}:{:02d}Z INFO worker-{} processed job id={} in {}ms status=ok\n"
+
+
+def chat_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=words))
+
+
+def paste_text(rng: random.Random, size: int) -> str:
+    lines = []
+    while sum(map(len, lines)) < size:
+        lines.append(LOG_LINE.format(rng.randint(0, 59), rng.randint(0, 59), rng.randint(1, 8),
+                                     rng.randint(1, 10 ** 6), rng.randint(1, 999)))
+    return "".join(lines)
+
+
+def sample_message(rng: random.Random) -> str:
+    """大多數是短訊息，少數長段落與貼上的記錄檔"""
+    roll = rng.random()
+    if roll < 0.80:
+        return chat_text(rng, rng.randint(1, 20))
+    if roll < 0.95:
+        return chat_text(rng, rng.randint(20, 200))
+    if roll < 0.99:
+        return chat_text(rng, rng.randint(200, 1500))
+    return paste_text(rng, rng.randint(2_000, 16_000))
+
+
+def run(engine, author_id, label: str, threshold: int, contents: list[str], pages: int):
+    models.MESSAGE_COMPRESS_THRESHOLD = threshold
+    with Session(engine) as session:
+        room = ChatRoomService(session).create_chat_room_with_members(ChatRoom(name=label), [author_id])
+        room_id = room.id
+        author = session.get(User, author_id)
+
+        started = time.perf_counter()
+        for content in contents:
+            MessageService(session).create_message(author, session.get(ChatRoom, room_id), content)
+        insert_elapsed = time.perf_counter() - started
+
+        stored = session.exec(
+            select(func.sum(func.length(Message.content)) +
+                   func.sum(func.coalesce(func.length(Message.compressed_content), 0)))
+            .where(Message.chatroom_id == room_id)
+        ).one()
+        ids = session.exec(select(Message.id).where(Message.chatroom_id == room_id)).all()
+
+        rng = random.Random(0)
+        timings = []
+        for _ in range(pages):
+            before_id = rng.choice(ids)
+            started = time.perf_counter()
+            MessageService(session).get_messages_by_room(room_id, author_id, limit=50, before_id=before_id)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+    print(f"{label:12} stored={stored / 1024:9.1f}KiB insert={len(contents) / insert_elapsed:6.0f}/s "
+          f"page p50={statistics.median(timings):6.2f}ms p95={timings[int(len(timings) * 0.95) - 1]:6.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較訊息壓縮前後的儲存量與歷史分頁延遲（會寫入測試資料，請勿對正式資料庫執行）")
+    parser.add_argument("--url", default="sqlite:///compression_bench.db")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        author_id = create_user(session, User(user_id=f"bench_{time.time_ns()}"[:20], username="Bench",
+                                              hash_password="x", salt="x")).id
+
+    rng = random.Random(42)
+    contents = [sample_message(rng) for _ in range(args.messages)]
+    raw = sum(len(content.encode("utf-8")) for content in contents)
+    print(f"messages={len(contents)} raw={raw / 1024:.1f}KiB "
+          f"compress_threshold={models.MESSAGE_COMPRESS_THRESHOLD}B")
+    threshold = models.MESSAGE_COMPRESS_THRESHOLD
+    run(engine, author_id, "uncompressed", 1 << 62, contents, args.pages)
+    run(engine, author_id, "compressed", threshold, contents, args.pages)
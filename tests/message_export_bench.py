@@ -0,0 +1,75 @@
+import argparse
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description="量測聊天室歷史匯出的吞吐量與記憶體用量（會寫入測試資料，請勿對正式資料庫執行）")
+parser.add_argument("--url", help="覆寫 DATABASE_URL，例如 sqlite:///export_bench.db 或 postgresql://...")
+parser.add_argument("--messages", type=int, default=1_000_000)
+parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+args = parser.parse_args()
+# 必須在匯入 database.database 之前設定，engine 於匯入時建立
+if args.url:
+    os.environ["DATABASE_URL"] = args.url
+
+from sqlalchemy import insert, update
+from sqlmodel import select
+from database.database import create_db_and_tables, engine, get_session_context
+from database.models import ChatRoom, Message, User, uuid7
+from database.service import ChatRoomService, create_user, get_user_by_user_id
+from routes.message import _iter_export_chunks
+
+BATCH_SIZE = 10_000
+BENCH_USER_ID = "export_bench"
+
+
+def seed(total: int):
+    """建立（或沿用）一個有 total 則訊息的聊天室，已寫入的訊息不重建"""
+    room_name = f"export_bench_{total}"
+    with get_session_context() as session:
+        author = get_user_by_user_id(session, BENCH_USER_ID) or create_user(
+            session, User(user_id=BENCH_USER_ID, username="Export Bench", hash_password="x", salt="x"))
+        room = session.exec(select(ChatRoom).where(ChatRoom.name == room_name)).first()
+        if room is None:
+            room = ChatRoomService(session).create_chat_room_with_members(ChatRoom(name=room_name), [author.id])
+        author_id, room_id, existing = author.id, room.id, room.last_seq
+
+    started_at = datetime.now(timezone.utc) - timedelta(seconds=total)
+    for start in range(existing, total, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, total)
+        rows = [{"id": uuid7(), "author_id": author_id, "chatroom_id": room_id, "seq": seq,
+                 "content": f"export bench message {seq} " + "lorem ipsum " * (seq % 8),
+                 "created_at": started_at + timedelta(seconds=seq), "is_deleted": False}
+                for seq in range(start + 1, end + 1)]
+        with engine.begin() as conn:
+            conn.execute(insert(Message), rows)
+            conn.execute(update(ChatRoom).where(ChatRoom.id == room_id).values(last_seq=end))
+        print(f"seeded {end}/{total}", end="\r")
+    if existing < total:
+        print()
+    return author_id, room_id
+
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    author_id, room_id = seed(args.messages)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rows = size = chunks = 0
+    started = time.perf_counter()
+    for chunk in _iter_export_chunks(room_id, author_id, args.format, 0):
+        chunks += 1
+        size += len(chunk.encode("utf-8"))
+        rows += chunk.count("\n")
+    elapsed = time.perf_counter() - started
+    # ru_maxrss 在 Linux 以 KiB 計；匯出期間的峰值增量應與聊天室大小無關。
+    # SQLite 的 page cache 與 mmap 也算在 RSS 內，上限分別為 SQLITE_CACHE_SIZE_KB、SQLITE_MMAP_SIZE
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    print(f"backend={engine.dialect.name} format={args.format} messages={args.messages}")
+    print(f"rows={rows} chunks={chunks} size={size / 1024 / 1024:.1f}MiB elapsed={elapsed:.2f}s "
+          f"{rows / elapsed:.0f} rows/s {size / 1024 / 1024 / elapsed:.1f}MiB/s peak_rss_growth={rss_growth / 1024:.1f}MiB")
@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert, text
+from sqlmodel import Session, SQLModel, create_engine, select
+from database.models import User, uuid7
+from database.service import search_users
+
+BATCH_SIZE = 10_000
+
+
+def seed(engine, total: int):
+    """補足到 total 個使用者，已存在的不重建"""
+    with Session(engine) as session:
+        existing = session.exec(select(func.count()).select_from(User)).one()
+    rng = random.Random(existing)
+    for start in range(existing, total, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, total)):
+            name = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+            rows.append({"id": uuid7(), "user_id": f"{name[:12]}{i}", "username": name.capitalize(),
+                         "hash_password": "x", "salt": "x", "membership_version": 0})
+        with engine.begin() as conn:
+            conn.execute(insert(User), rows)
+        print(f"seeded {min(start + BATCH_SIZE, total)}/{total}", end="\r")
+    print()
+
+
+def bench(engine, queries: list[str], rounds: int):
+    with Session(engine) as session:
+        for query in queries:
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                users = search_users(session, query, 20, 0)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            print(f"q={query!r:10} hits={len(users):2} "
+                  f"p50={statistics.median(timings):8.2f}ms p95={timings[int(len(timings) * 0.95) - 1]:8.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用者搜尋延遲測試（會寫入測試用使用者，請勿對正式資料庫執行）")
+    parser.add_argument("--url", default="sqlite:///search_bench.db")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    SQLModel.metadata.create_all(engine)
+    seed(engine, args.users)
+    # 短前綴、長前綴、不存在的前綴、子字串／模糊
+    bench(engine, ["a", "ab", "abcd", "zzzzzz", "xqv", "marn"], args.rounds)
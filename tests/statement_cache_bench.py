@@ -0,0 +1,101 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import Session, SQLModel, create_engine, select
+from database.models import ChatRoom, ChatRoomPivot, Message, MessageRead, User
+from database.service import ChatRoomService, MessageService, create_user, get_user_by_id, warm_statement_cache
+
+
+# 改用 lambda_stmt 之前的寫法：每次呼叫都重新建構 select()／Query，
+# 編譯結果同樣由 engine 的 compiled cache 快取，差別只在建構與產生快取鍵的成本
+def legacy_get_messages_by_room(session: Session, room_id, user_id, limit: int):
+    is_read_subq = (
+        select(MessageRead.id)
+        .where(MessageRead.message_id == Message.id, MessageRead.user_id == user_id)
+        .exists()
+    )
+    return (
+        session.query(Message, User.username.label("author_name"), is_read_subq.label("is_read"))
+        .join(User, Message.author_id == User.id)
+        .filter(Message.chatroom_id == room_id, Message.is_deleted.is_(False))
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def legacy_get_chat_room_by_id(session: Session, room_id):
+    return session.exec(select(ChatRoom).where(ChatRoom.id == room_id)).first()
+
+
+def legacy_get_chat_rooms_by_user(session: Session, user: User):
+    return session.exec(select(ChatRoom).join(ChatRoomPivot).where(ChatRoomPivot.user_id == user.id)).all()
+
+
+def legacy_get_user_by_id(session: Session, user_id):
+    return session.exec(select(User).where(User.id == user_id)).first()
+
+
+def setup(engine, messages: int):
+    with Session(engine) as session:
+        user = create_user(session, User(user_id=f"bench_{time.time_ns()}"[:20], username="Bench",
+                                         hash_password="x", salt="x"))
+        room = ChatRoomService(session).create_chat_room_with_members(ChatRoom(name="bench"), [user.id])
+        for i in range(messages):
+            MessageService(session).create_message(user, room, f"message {i}")
+        return user.id, room.id
+
+
+def per_call_us(engine, func, calls: int) -> float:
+    """以 process_time 量測每次呼叫的 CPU 時間（微秒），排除等待 I/O 的時間"""
+    with Session(engine) as session:
+        func(session)
+        started = time.process_time()
+        for _ in range(calls):
+            func(session)
+            session.expunge_all()
+        return (time.process_time() - started) / calls * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較熱路徑查詢改用 lambda_stmt 前後的每次呼叫 CPU 時間（會寫入測試資料，請勿對正式資料庫執行）")
+    parser.add_argument("--url", default="sqlite://")
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50)
+    args = parser.parse_args()
+
+    # 舊寫法使用 session.query()，SQLModel 會發出 DeprecationWarning
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    engine = create_engine(args.url)
+    SQLModel.metadata.create_all(engine)
+    user_id, room_id = setup(engine, args.messages)
+    with Session(engine) as session:
+        warm_statement_cache(session)
+
+    # (舊寫法, 新寫法)，兩者在同一個 engine 上執行，compiled cache 皆開啟；
+    # 新的 get_messages_by_room 另外組出 DTO，比較結果對新寫法較不利
+    queries = {
+        "get_messages_by_room": (
+            lambda s: legacy_get_messages_by_room(s, room_id, user_id, 20),
+            lambda s: MessageService(s).get_messages_by_room(room_id, user_id, limit=20)),
+        "get_chat_room_by_id": (
+            lambda s: legacy_get_chat_room_by_id(s, room_id),
+            lambda s: ChatRoomService(s).get_chat_room_by_id(room_id)),
+        "get_chat_rooms_by_user": (
+            lambda s: legacy_get_chat_rooms_by_user(s, s.get(User, user_id)),
+            lambda s: ChatRoomService(s).get_chat_rooms_by_user(s.get(User, user_id))),
+        "get_user_by_id": (
+            lambda s: legacy_get_user_by_id(s, user_id),
+            lambda s: get_user_by_id(s, user_id)),
+    }
+    print(f"backend={engine.dialect.name} calls={args.calls}")
+    for name, (legacy, cached) in queries.items():
+        before = per_call_us(engine, legacy, args.calls)
+        after = per_call_us(engine, cached, args.calls)
+        print(f"{name:24} select()={before:8.1f}us lambda_stmt={after:8.1f}us saved={before - after:8.1f}us "
+              f"({(before - after) / before:5.1%})")
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlmodel import select
+from database.models import ChatRoom, ChatRoomPivot, User
+from database.service import ChatRoomService, MessageService
+
+
+def test_joining_twice_is_ignored_and_bumps_version_once(session):
+    user = User(user_id="u1", username="U1", hash_password="x", salt="x")
+    room = ChatRoom(name="r")
+    session.add_all([user, room])
+    session.commit()
+
+    service = ChatRoomService(session)
+    service.add_user_to_chat_room(user, room)
+    service.add_user_to_chat_room(user, room)
+
+    assert service.get_member_ids(room.id) == [user.id]
+    assert session.get(User, user.id).membership_version == 1
+
+def test_recent_rooms_compare_message_time_with_creation_time(session):
+    user = User(user_id="u1", username="U1", hash_password="x", salt="x")
+    active = ChatRoom(name="active")
+    session.add_all([user, active])
+    session.commit()
+
+    service = ChatRoomService(session)
+    service.add_user_to_chat_room(user, active)
+    MessageService(session).create_message(user, active, "hi")
+
+    # 之後才建立、尚無訊息的聊天室應排在前面
+    fresh = ChatRoom(name="fresh")
+    session.add(fresh)
+    session.commit()
+    service.add_user_to_chat_room(user, fresh)
+
+    assert service.get_chat_room_ids_by_user(user.id, 2) == [fresh.id, active.id]
+
+def test_bulk_added_members_record_joined_at_in_utc(session):
+    users = [User(user_id=f"u{i}", username=f"U{i}", hash_password="x", salt="x") for i in range(3)]
+    session.add_all(users)
+    session.commit()
+
+    service = ChatRoomService(session)
+    room = service.create_chat_room_with_members(ChatRoom(name="r"), [users[0].id])
+    service.add_users_to_chat_room(room, [users[1].id])
+    service.add_user_to_chat_room(users[2], room)
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    joined = session.exec(select(ChatRoomPivot.joined_at).where(ChatRoomPivot.chatroom_id == room.id)).all()
+    assert len(joined) == 3
+    assert all(abs(now - joined_at) < timedelta(minutes=1) for joined_at in joined)
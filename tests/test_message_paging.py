@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from database.models import ChatRoom, Message, User, uuid7
+from database.service import MessageService
+
+
+def test_before_id_pages_through_mixed_uuid4_and_uuid7_history(session):
+    user = User(user_id="u1", username="U1", hash_password="x", salt="x")
+    room = ChatRoom(name="r")
+    session.add_all([user, room])
+    session.commit()
+
+    started = datetime(2024, 1, 1)
+    # 升級前的訊息使用 uuid4，之後的訊息使用 UUIDv7
+    legacy = [Message(id=uuid4(), author_id=user.id, chatroom_id=room.id, content=f"old{i}",
+                      seq=i + 1, created_at=started + timedelta(minutes=i)) for i in range(10)]
+    recent = [Message(id=uuid7(), author_id=user.id, chatroom_id=room.id, content=f"new{i}",
+                      seq=i + 11, created_at=started + timedelta(days=1, minutes=i)) for i in range(5)]
+    session.add_all(legacy + recent)
+    session.commit()
+
+    service = MessageService(session)
+    seen = []
+    before_id = None
+    while True:
+        page = service.get_messages_by_room(room.id, user.id, limit=4, before_id=before_id)
+        if not page:
+            break
+        seen.extend(message.content for message in page)
+        before_id = page[-1].id
+
+    expected = [f"new{i}" for i in reversed(range(5))] + [f"old{i}" for i in reversed(range(10))]
+    assert seen == expected
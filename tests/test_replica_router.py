@@ -0,0 +1,38 @@
+import os
+from uuid import uuid4
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+import database.database as database
+from database.database import ReplicaRouter
+
+
+def test_expired_sticky_users_are_dropped_on_later_writes(monkeypatch):
+    router = ReplicaRouter([object()])
+    monkeypatch.setattr(database, "DB_READ_YOUR_WRITES_WINDOW", 0)
+    for _ in range(100):
+        router.mark_user_write(uuid4())
+    assert len(router._sticky_until) <= 1
+
+    monkeypatch.setattr(database, "DB_READ_YOUR_WRITES_WINDOW", 60)
+    active = uuid4()
+    router.mark_user_write(active)
+    router.mark_user_write(uuid4())
+    router.mark_user_write(active)
+    assert list(router._sticky_until)[-1] == active
+    assert len(router._sticky_until) == 2
+
+def test_read_failing_on_replica_is_retried_on_primary(monkeypatch):
+    replica = create_engine("sqlite://")
+    router = ReplicaRouter([replica], read_your_writes=False)
+    monkeypatch.setattr(database, "replica_router", router)
+
+    def query(session):
+        if session.get_bind().engine is replica:
+            raise OperationalError("SELECT 1", {}, Exception("server closed the connection unexpectedly"))
+        return "primary"
+
+    assert database.run_read(query) == "primary"
+    assert router.connect() is None
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import BigInteger, Column, MetaData, String, Table, insert
+from sqlmodel import create_engine
+from database.models import Message, uuid7
+
+BATCH_SIZE = 10_000
+
+
+def bench_table(name: str) -> Table:
+    """與 Messages 相同型別的主鍵，只保留少量欄位以凸顯主鍵 B-tree 的寫入成本"""
+    return Table(
+        name, MetaData(),
+        Column("id", Message.__table__.c.id.type, primary_key=True),
+        Column("seq", BigInteger, nullable=False),
+        Column("content", String, nullable=False),
+    )
+
+
+def run(engine, label: str, make_id, rows: int, report_every: int):
+    table = bench_table(f"uuid_bench_{label}")
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+
+    started = window_started = time.perf_counter()
+    for start in range(0, rows, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, rows)
+        with engine.begin() as conn:
+            conn.execute(insert(table), [{"id": make_id(), "seq": seq, "content": f"message {seq}"}
+                                         for seq in range(start, end)])
+        if end % report_every == 0 or end == rows:
+            now = time.perf_counter()
+            window = (end - 1) % report_every + 1
+            print(f"{label:6} rows={end:>10,} last {window:,}: {window / (now - window_started):8.0f} rows/s")
+            window_started = now
+    elapsed = time.perf_counter() - started
+    print(f"{label:6} total {rows:,} rows in {elapsed:.1f}s: {rows / elapsed:.0f} rows/s")
+    table.drop(engine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較 uuid4 與 UUIDv7 主鍵的寫入吞吐量（會建立並刪除測試資料表，請勿對正式資料庫執行）")
+    parser.add_argument("--url", default="sqlite:///uuid_bench.db")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--report-every", type=int, default=250_000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    print(f"backend={engine.dialect.name} rows={args.rows:,} batch={BATCH_SIZE:,}")
+    run(engine, "uuid4", uuid4, args.rows, args.report_every)
+    run(engine, "uuid7", uuid7, args.rows, args.report_every)